@@ -1,157 +1,2536 @@
 import re
 import os
+import sys
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import pickle
+import time
+from array import array
+from collections import deque
+from itertools import islice, compress
+# NumPy is only needed for the vectorized batch mode and is slow to
+# import, so it is imported by load_numpy the first time a batch is run.
+# Without it batches fall back to running one string at a time
+numpy = None
+numpy_loaded = False
 chars=["!","\"","#","$","%","&","'","(",")","*","+",",","-",".","/","0","1","2","3","4","5","6","7","8","9",":",";","<","=",">","?","@","A","B","C","D","E","F","G","H","I","J","K","L","M","N","O","P","Q","R","S","T","U","V","W","X","Y","Z","[","\\","]","^","_","a","b","c","d","e","f","g","h","i","j","k","l","m","n","o","p","q","r","s","t","u","v","w","x","y","z","{","|","}","~"]
 line_regex = re.compile("(\d+),(.*),(\d+)")
+# State a DFA falls into when it has no transition for a character
+TRAP_STATE = 255
+# Largest state number a machine file may use by default. Machines
+# with bigger states are INVALID unless the limit is raised
+MAX_STATE = 255
+# Returned by the compiled engines when a string holds a character
+# outside of the machine's alphabet
+INVALID = -1
+# Bumped whenever the compiled engines change shape or the results
+# they write change, so that compiled machines cached and results
+# written by an older version are not picked up
+ENGINE_VERSION = 8
+# Name of the file in results that records what each result was
+# computed from
+MANIFEST = "manifest.json"
+# Number of input lines handed to the engines at a time
+BATCH_SIZE = 65536
+# Bytes that str.strip removes from the ends of an ASCII line
+WHITESPACE = frozenset(b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f")
+# Number of bytes of a mapped input file searched for newlines at a time
+MAP_WINDOW = 1 << 22
+# Largest number of bytes of input a worker runs at a time when sharding
+# with --stream, so only that many accepted lines are held at once
+STREAM_CHUNK = 1 << 24
+# Largest number of DFA states the subset construction may build before
+# an NFA falls back to bitset simulation
+SUBSET_LIMIT = 4096
+# Largest number of DFA states the lazy engine keeps cached at once
+LAZY_CACHE_SIZE = 1024
+# A cache flush that comes less than this many characters per cached
+# state after the previous one counts as thrashing
+LAZY_MIN_CHARS = 10
+# Number of thrashing flushes before the lazy engine gives up on its
+# cache and simulates the NFA directly
+LAZY_THRASH_LIMIT = 3
+# Largest number of comparisons per character, on average, that the
+# code generated for a dense engine may make. Above it "codegen" keeps
+# the dense engine, as its table lookup is quicker than that many tests
+CODEGEN_TEST_LIMIT = 7
+# Engines a machine can be run with. "auto" runs DFAs on the dense
+# table and tries the subset construction on NFAs first, falling back
+# to the lazy engine. "codegen" compiles the dense table to Python code
+# unless it has too many rows or branches for that to pay off, the
+# other engines only change how NFAs are run
+ENGINES = ["auto", "dense", "bitset", "lazy", "codegen"]
 
 class Machine():
-    def __init__(self, machine_file):
+    def __init__(self, machine_file, engine="auto", lazy_cache=LAZY_CACHE_SIZE, max_state=MAX_STATE,
+                 trap_state=TRAP_STATE):
         """Initialize a machine given a machine text file.
         Sets most of the items to their base type and their empty
         initializations.
         It then calls the read machine function to parse the file.
         At the end, if there hasn't been any change of the machine type
         upon being processed, it sets the machine type to a DFA.
+        engine picks how the machine is run (one of ENGINES), or None
+        to only parse the machine file, and lazy_cache bounds the
+        number of states the lazy engine caches.
+        max_state is the largest state the machine file may use, or None
+        for no limit, and trap_state is the state a DFA falls into when
+        it has no transition for a character.
+        The time taken to parse the file and to build the engine is
+        kept for the log.
         """
         self.lookup = {}
         self.accept = []
         self.current_state = 0
+        self.max_state = max_state
+        self.trap_state = trap_state
         self.alphabet = set()
         self.language = []
         self.machine_type = ""
         self.states = set() 
+        self.nfa_lookup = {}
+        # One message per problem found while reading the machine file
+        self.diagnostics = []
+        self.engine = None
+        # Counters filled in by profile_input, None unless profiling
+        self.stats = None
+        self.compile_seconds = 0.0
+        start = time.perf_counter()
         self.read_machine(machine_file)
         if self.machine_type == "":
             self.machine_type = "DFA"
+        self.parse_seconds = time.perf_counter() - start
+        if engine is not None:
+            self.build_engine(engine, lazy_cache)
+
+    def build_engine(self, engine="auto", lazy_cache=LAZY_CACHE_SIZE):
+        """Builds the engine the machine is run with from the tables
+        read from the machine file. INVALID machines get no engine.
+        """
+        start = time.perf_counter()
+        self.engine = None
+        if self.machine_type == "DFA":
+            self.engine = self.compile()
+        elif self.machine_type == "NFA":
+            if engine == "dense":
+                self.engine = self.determinize()
+            elif engine in ("auto", "codegen"):
+                self.engine = self.determinize(SUBSET_LIMIT)
+            if engine == "bitset":
+                self.engine = self.bitset()
+            elif self.engine is None:
+                self.engine = LazyMachine(self.bitset(), lazy_cache)
+        if (engine == "codegen" and isinstance(self.engine, CompiledMachine)
+                and generated_tests(self.engine, row_branches(self.engine)) <= CODEGEN_TEST_LIMIT):
+            self.engine = GeneratedMachine(self.engine)
+        if self.engine is not None:
+            self.current_state = self.engine.start
+        self.compile_seconds = time.perf_counter() - start
+
+    def save_compiled(self, cache_path):
+        """Writes the parsed and compiled machine to cache_path so it can
+        be loaded back with load_compiled without parsing the machine
+        file. Only what is needed to run the machine and write its log
+        is kept, the lookup tables the engine was compiled from are not.
+        """
+        compiled = {
+            "machine_type": self.machine_type,
+            "accept": self.accept,
+            "alphabet": self.alphabet,
+            "states": self.states,
+            "diagnostics": self.diagnostics,
+            "engine": self.engine,
+        }
+        # Write to a temporary file first so a reader never sees a
+        # half written entry
+        temp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        with open(temp_path, "wb") as cache_file:
+            pickle.dump(compiled, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+        # Keep the source of generated engines next to the entry too
+        if isinstance(self.engine, GeneratedMachine):
+            with open("{}.py".format(os.path.splitext(cache_path)[0]), "w") as source_file:
+                source_file.write(self.engine.source)
+
+    @classmethod
+    def load_compiled(cls, cache_path):
+        """Returns a Machine loaded from a file written by save_compiled.
+        Loading the file counts as parsing, nothing is compiled.
+        """
+        start = time.perf_counter()
+        with open(cache_path, "rb") as cache_file:
+            compiled = pickle.load(cache_file)
+        machine = cls.__new__(cls)
+        machine.lookup = {}
+        machine.nfa_lookup = {}
+        machine.language = []
+        machine.diagnostics = []
+        machine.stats = None
+        machine.__dict__.update(compiled)
+        machine.reset_machine()
+        machine.parse_seconds = time.perf_counter() - start
+        machine.compile_seconds = 0.0
+        return machine
 
     def reset_machine(self):
-        """Set the current state of the machine to 0
+        """Set the current state of the machine back to the start
+        state of its engine
         """
-        self.current_state = 0
+        self.current_state = self.engine.start if self.engine is not None else 0
 
     def read_machine(self, machine_file):
         """Reads a machine and collects metrics based off a
         machine file.
+        The file is read in one go and each line is split on its
+        commas, only the lines that don't split cleanly into a state,
+        a character and a state go through the regular expression.
+        Reading doesn't stop at the first problem: every line is
+        checked and a message for each problem is added to
+        diagnostics, while the tables are left as they were when the
+        machine first turned out to be INVALID.
         """
         with open(machine_file, "r+") as definition:
+            lines = definition.read().split("\n")
+        try:
+            # Try reading the list of accept states from the
+            # first line of the file
+            self.accept = re.search("{(.+?)}", lines[0]).group(1).split(",")
+        except AttributeError:
+            # If we can't, we don't care. DFA can have no accept 
+            # states and still be valid.
+            pass
+        diagnostics = self.diagnostics
+        invalid = False
+        limit = self.max_state
+        if limit is None:
+            state_range = "a state"
+        else:
+            state_range = "a state from 0 to {}".format(limit)
+        for i in self.accept:
+            # Check that each accept state is a valid state
+            # 0-max_state
             try:
-                # Try reading the list of accept states from the
-                # first line of the file
-                self.accept = re.search("{(.+?)}", definition.readline()).group(1).split(",")
-            except AttributeError:
-                # If we can't, we don't care. DFA can have no accept 
-                # states and still be valid.
-                pass
-            for i in self.accept:
-                # Check that each accept state is a valid state
-                # 0-255
-                if not int(i) < 256:
-                    self.machine_type = "INVALID"
-                    return
-            for line in definition:
-                # If a line is empty, skip it because typos can exist
-                if re.match("\s",line):
+                valid = limit is None or int(i) <= limit
+            except ValueError:
+                valid = False
+            if not valid:
+                diagnostics.append("line 1: accept state {!r} is not {}".format(i, state_range))
+                invalid = True
+            elif not i.isdecimal():
+                # Accept states are matched to states as they are
+                # written, and states are only ever digits
+                diagnostics.append("line 1: accept state {!r} is not written like a state, "
+                                   "so it never accepts".format(i))
+        # Most states are small and written without leading zeros, so
+        # they can be checked without converting them
+        state_names = set(str(x) for x in range(min(256, limit + 1) if limit is not None else 256))
+        nfa = False
+        states = self.states
+        alphabet = self.alphabet
+        nfa_lookup = self.nfa_lookup
+        lookup = self.lookup
+        for number, line in enumerate(lines[1:], 2):
+            # If a line is empty, skip it because typos can exist
+            if not line or line[0].isspace():
+                continue
+            fields = line.split(",")
+            if len(fields) != 3 or not (fields[0].isdecimal() and fields[2].isdecimal()):
+                # Commas in the character or anything else out of the
+                # ordinary is left to the regular expression
+                line_search = line_regex.search(line)
+                if line_search is None:
+                    # If there is no transition on the line, assume
+                    # an epsilon transition and mark the machine as
+                    # an NFA. There is nothing to add to the table
+                    # as we don't know the states either
+                    diagnostics.append("line {}: no transition found, read as an epsilon transition".format(number))
+                    if not nfa and not invalid:
+                        self.mark_nfa()
+                        nfa = True
                     continue
-                # Perform the regex match on each line using the 
-                # compiled regex on line 4
-                line_search = re.search(line_regex,line)
-                # Try to get a character from the capture groups 
-                # in the regular expression match
-                try:
-                    transition_char = line_search.group(2)
-                except AttributeError:
-                    # If we can't get a character in that group,
-                    # assume epsilon transition and mark machine as
-                    # an NFA
-                    self.machine_type = "NFA"
-                    return
-                # Verify that both the beginning state and the
-                # state to transition to are valid states
-                # in the same way as the accept states
-                # and add that state to the list
-                # of states if it is valid
-                from_state = line_search.group(1)
-                if not int(from_state) < 256:
-                     self.machine_type = "INVALID"
-                     return
-                self.states.add(from_state)
-                to_state = line_search.group(3)
-                if not int(to_state) < 256:
-                     self.machine_type = "INVALID"
-                     return
-                self.states.add(to_state)
-                # If all works, add the transition character to 
-                # the list of characters in the alphabet
-                self.alphabet.add(transition_char)
-                # If the transition character isn't one of 
-                # the printable characters (or ` signifying epsilon)
-                # then we treat it specially
-                if transition_char not in chars:
-                    if transition_char == '`':
-                        self.machine_type = "NFA"
-                        return
-                    else:
-                        self.machine_type = "INVALID"
-                        return
-                # Set up the lookup table
-                try:
-                    self.lookup[transition_char]
-                except:
-                    self.lookup[transition_char]={}
-                
-                # Set up the table for the char
-                try:
-                    self.lookup[transition_char][from_state]
-                    self.machine_type = "NFA"
-                    return
-                except:
-                    self.lookup[transition_char][from_state]=to_state
+                fields = line_search.groups()
+            from_state, transition_char, to_state = fields
+            from_valid = from_state in state_names or limit is None or int(from_state) <= limit
+            to_valid = to_state in state_names or limit is None or int(to_state) <= limit
+            char_valid = transition_char in chars or transition_char == '`'
+            if not invalid:
+                # Add the states and the character in the same order
+                # they are checked in, so a machine that turns out to
+                # be INVALID keeps what was added up to that point
+                if from_valid:
+                    states.add(from_state)
+                    if to_valid:
+                        states.add(to_state)
+                        alphabet.add(transition_char)
+            if not from_valid:
+                diagnostics.append("line {}: state {} is not {}".format(number, from_state, state_range))
+            if not to_valid:
+                diagnostics.append("line {}: state {} is not {}".format(number, to_state, state_range))
+            if not char_valid:
+                diagnostics.append("line {}: character {!r} is not a printable character".format(number, transition_char))
+            if invalid or not (from_valid and to_valid and char_valid):
+                invalid = True
+                continue
+            if transition_char == '`':
+                diagnostics.append("line {}: epsilon transition from state {}".format(number, from_state))
+                if not nfa:
+                    self.mark_nfa()
+                    nfa = True
+            elif not nfa and from_state in lookup.get(transition_char, ()):
+                # A second transition on the same character from
+                # the same state also makes this an NFA
+                diagnostics.append("line {}: second transition on {!r} from state {}".format(number, transition_char, from_state))
+                self.mark_nfa()
+                nfa = True
+            # Once the machine is an NFA, every transition goes
+            # into the NFA table instead
+            if nfa:
+                nfa_lookup.setdefault(transition_char, {}).setdefault(from_state, set()).add(to_state)
+            else:
+                lookup.setdefault(transition_char, {})[from_state] = to_state
+        if invalid:
+            self.machine_type = "INVALID"
+
+    def number_states(self):
+        """Returns a dict giving each state of the machine file, as it is
+        written, the number the engines know it by. States are matched as
+        strings, so one written with leading zeros like 01 is a different
+        state than 1, and gets a number past every other state rather
+        than its value. The start state 0 is always numbered.
+        """
+        numbers = dict((x, int(x)) for x in self.states if str(int(x)) == x)
+        numbers["0"] = 0
+        next_number = max(list(numbers.values()) + [self.trap_state]) + 1
+        for state in sorted(set(self.states) - set(numbers)):
+            numbers[state] = next_number
+            next_number += 1
+        return numbers
+
+    def mark_nfa(self):
+        """Marks the machine as an NFA and moves any transitions read
+        so far from the DFA lookup table into the NFA table, where
+        each character and state lead to a set of states.
+        """
+        self.machine_type = "NFA"
+        for char in self.lookup:
+            for from_state, to_state in self.lookup[char].items():
+                self.nfa_lookup.setdefault(char, {}).setdefault(from_state, set()).add(to_state)
+        self.lookup = {}
+
+    def determinize(self, limit=None):
+        """Builds a CompiledMachine from the NFA table using the subset
+        construction. Each row of the result stands for the epsilon
+        closure of a set of NFA states, starting from the closure of
+        state 0. The empty set is the trap row, as an NFA that has no
+        transition for a character can't go anywhere.
+        Returns None if the construction needs more than limit rows.
+        """
+        numbers = self.number_states()
+        epsilon = {}
+        for from_state, to_states in self.nfa_lookup.get('`', {}).items():
+            epsilon[numbers[from_state]] = set(numbers[x] for x in to_states)
+        columns = dict((char, column) for column, char in enumerate(sorted(x for x in self.nfa_lookup if x != '`')))
+        width = len(columns)
+        moves = [None] * width
+        for char, column in columns.items():
+            moves[column] = dict((numbers[from_state], set(numbers[x] for x in to_states))
+                                 for from_state, to_states in self.nfa_lookup[char].items())
+        accept_states = set(numbers[x] for x in self.accept if x in numbers)
+
+        def closure(states):
+            # Follow epsilon transitions until no new states turn up
+            found = set(states)
+            pending = list(states)
+            while pending:
+                for to_state in epsilon.get(pending.pop(), ()):
+                    if to_state not in found:
+                        found.add(to_state)
+                        pending.append(to_state)
+            return frozenset(found)
+
+        subsets = [closure([0])]
+        rows = {subsets[0]: 0}
+        entries = []
+        row = 0
+        while row < len(subsets):
+            for column in range(width):
+                next_states = set()
+                for state in subsets[row]:
+                    next_states.update(moves[column].get(state, ()))
+                next_subset = closure(next_states)
+                if next_subset not in rows:
+                    if limit is not None and len(subsets) == limit:
+                        return None
+                    rows[next_subset] = len(subsets)
+                    subsets.append(next_subset)
+                entries.append(rows[next_subset] * width)
+            row += 1
+        accept = bytearray(len(subsets))
+        for row, subset in enumerate(subsets):
+            if subset & accept_states:
+                accept[row] = 1
+        return CompiledMachine(columns, array(compact_typecode(len(subsets) * width), entries), accept,
+                               array(compact_typecode(len(subsets)), range(len(subsets))), rows.get(frozenset()))
+
+    def bitset(self):
+        """Builds a BitsetMachine from the NFA table. Sets of NFA states
+        are kept as ints with bit s set for state s, which is cheap as
+        long as the state numbers are small.
+        For every state the epsilon closure is worked out once, and the
+        successors on each character are stored already closed, so a
+        step never has to follow epsilon transitions.
+        """
+        numbers = self.number_states()
+        size = max(numbers.values()) + 1
+        epsilon = [0] * size
+        for from_state, to_states in self.nfa_lookup.get('`', {}).items():
+            for to_state in to_states:
+                epsilon[numbers[from_state]] |= 1 << numbers[to_state]
+        closure = [0] * size
+        for state in range(size):
+            found = 1 << state
+            pending = found
+            while pending:
+                low = pending & -pending
+                pending ^= low
+                new = epsilon[low.bit_length() - 1] & ~found
+                found |= new
+                pending |= new
+            closure[state] = found
+        accept = 0
+        for state in self.accept:
+            if state in numbers:
+                accept |= 1 << numbers[state]
+        # Find the states that can still reach an accept state and leave
+        # the others out of every set, so a set with no live states left
+        # in it is empty
+        inverse = {}
+        for char in self.nfa_lookup:
+            for from_state, to_states in self.nfa_lookup[char].items():
+                for to_state in to_states:
+                    inverse.setdefault(numbers[to_state], set()).add(numbers[from_state])
+        live = set(numbers[x] for x in self.accept if x in numbers)
+        pending = list(live)
+        while pending:
+            for from_state in inverse.get(pending.pop(), ()):
+                if from_state not in live:
+                    live.add(from_state)
+                    pending.append(from_state)
+        live_mask = 0
+        for state in live:
+            live_mask |= 1 << state
+        columns = dict((char, column) for column, char in enumerate(sorted(x for x in self.nfa_lookup if x != '`')))
+        moves = []
+        for char in sorted(columns, key=columns.get):
+            move = [0] * size
+            for from_state, to_states in self.nfa_lookup[char].items():
+                for to_state in to_states:
+                    move[numbers[from_state]] |= closure[numbers[to_state]] & live_mask
+            moves.append(move)
+        return BitsetMachine(columns, moves, accept, closure[0] & live_mask, sorted(numbers.values()))
             
 
+    def compile(self):
+        """Compiles the lookup table of a DFA into a CompiledMachine.
+        States are renumbered to rows with the start state as row 0
+        and the trap state as an explicit row, characters become
+        column indices, and any transition missing from the machine
+        file leads to the trap state. The table and the row names are
+        arrays of the smallest integer type that holds them.
+        """
+        trap_state = self.trap_state
+        numbers = self.number_states()
+        # The trap state is a state like any other, it can accept too
+        numbers.setdefault(str(trap_state), trap_state)
+        names = [0]
+        if trap_state != 0:
+            names.append(trap_state)
+        names.extend(sorted(set(numbers.values()) - set(names)))
+        names = array(compact_typecode(max(names)), names)
+        rows = dict((name, row) for row, name in enumerate(names))
+        columns = dict((char, column) for column, char in enumerate(sorted(self.lookup)))
+        width = len(columns)
+        # Every entry starts out pointing at the trap row, then the
+        # transitions from the machine file are filled in on top
+        table = array(compact_typecode(len(names) * width), [rows[trap_state] * width]) * (len(names) * width)
+        for char, column in columns.items():
+            for from_state, to_state in self.lookup[char].items():
+                table[rows[numbers[from_state]] * width + column] = rows[numbers[to_state]] * width
+        accept = bytearray(len(names))
+        for state in self.accept:
+            if state in numbers:
+                accept[rows[numbers[state]]] = 1
+        return CompiledMachine(columns, table, accept, names, rows[trap_state])
+
     def run_machine(self, input_string):
         if re.match("^\s+$", input_string):
-            if str(self.current_state) in self.accept:
+            if self.engine.is_accept(self.current_state):
                 self.language.append("\n")
                 return
             else:
                 return
-        # run the machine with input string by performing table lookups based on
-        # character and the current state
-        for input_char in input_string:
-            # If the character isn't valid in the alphabet, then
-            # skip this string, as it's not valid in the language
-            if input_char not in self.alphabet:
-                return    
-            try:
-                self.current_state = self.lookup[str(input_char)][str(self.current_state)]
-            except:
-                self.current_state = 255
-        if str(self.current_state) in self.accept:
+        # run the machine with input string through the engine,
+        # starting from the current state
+        state = self.engine.run(input_string, self.current_state)
+        # If a character isn't valid in the alphabet, then
+        # skip this string, as it's not valid in the language
+        if state == INVALID:
+            return
+        self.current_state = state
+        if self.engine.is_accept(state):
             self.language.append(input_string)
 
-if not os.path.exists(os.path.join(os.path.dirname(__file__),"results")):
-    os.makedirs(os.path.join(os.path.dirname(__file__),"results"))
+    def minimize(self):
+        """Replaces the engine with an equivalent one that has the fewest
+        possible states. The states of the machine file are kept as they
+        are, so metrics about the original machine are still available.
+        Returns the number of states before and after minimizing.
+        """
+        before = len(self.engine.names)
+        self.engine = self.engine.minimize()
+        return before, len(self.engine.names)
+
+    def accepts_batch(self, strings):
+        """Returns a list holding, for each string, whether the
+        machine accepts it. Does not touch the current state or the
+        language of the machine.
+        """
+        return self.engine.accepts_batch(strings)
+
+    def accepts_shared(self, strings):
+        """Same as accepts_batch, but walks the strings in sorted order
+        so that prefixes shared between strings are only run once.
+        """
+        return self.engine.accepts_shared(strings)
+
+    def accepts_spans(self, buffer, starts, ends):
+        """Same as accepts_batch, but for the lines buffer[starts[i]:ends[i]]
+        of a bytes-like buffer
+        """
+        return self.engine.accepts_spans(buffer, starts, ends)
+
+    def start(self):
+        """Returns a new Cursor at the start state of the engine. Each
+        cursor keeps its own state, so any number of strings can be fed
+        through the same machine at once, a piece at a time.
+        """
+        return Cursor(self.engine)
+
+
+def load_numpy():
+    """Imports NumPy the first time it is asked for and returns it, or
+    None if it isn't installed
+    """
+    global numpy, numpy_loaded
+    if not numpy_loaded:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+        numpy_loaded = True
+    return numpy
+
+
+def common_prefix_length(first, second):
+    """Returns the length of the longest common prefix of two strings.
+    Binary searches on slice comparisons, which run in C, rather than
+    comparing one character at a time.
+    """
+    low = 0
+    high = min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[low:middle] == second[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def shared_prefix_walk(engine, strings):
+    """Runs a list of strings through an engine in sorted order and
+    returns a list of booleans, one per string. path holds the state
+    after every prefix of the last string run, so the next string only
+    has to run the part after the prefix it shares with that string.
+    A string that hits a character outside of the alphabet ends its
+    path with INVALID, and one that reaches a dead state ends its path
+    with that state, which then also ends every string sharing the path.
+    """
+    accepted = [False] * len(strings)
+    previous = ""
+    path = [engine.start]
+    for i in sorted(range(len(strings)), key=strings.__getitem__):
+        input_string = strings[i]
+        shared = min(common_prefix_length(previous, input_string), len(path) - 1)
+        del path[shared + 1:]
+        state = path[shared]
+        if state != INVALID:
+            if engine.is_dead(state):
+                # The shared prefix already reached a dead state, so
+                # this string stops right there too
+                engine.rejected_early += 1
+            else:
+                for input_char in input_string[shared:]:
+                    state = engine.run(input_char, state)
+                    path.append(state)
+                    if state == INVALID or engine.is_dead(state):
+                        break
+                else:
+                    accepted[i] = engine.is_accept(state)
+        previous = input_string
+    return accepted
+
+
+def compact_typecode(largest):
+    """Returns the array typecode of the smallest unsigned integer type
+    that holds every value from 0 to largest
+    """
+    for typecode in "BHILQ":
+        if largest < 1 << (8 * array(typecode).itemsize):
+            return typecode
+    raise OverflowError("{} doesn't fit in an array".format(largest))
+
+
+def decode_spans(buffer, starts, ends):
+    """Returns the lines buffer[starts[i]:ends[i]] of a bytes-like buffer
+    as strings, for the engines that can only run strings
+    """
+    return [buffer[start:end].decode("utf-8", "replace") for start, end in zip(starts, ends)]
+
+
+def pack_batch(strings, byte_codes):
+    """Packs a list of strings for the vectorized engines. Strings with
+    non ASCII characters are left out, as they can't be in the language
+    of any machine. The rest are sorted longest first and their
+    characters are mapped through byte_codes into one flat array.
+    Returns the index of each packed string in the list, the packed
+    codes, the offset of each string in them, and for each column j
+    the number of strings longer than j, which are always the first
+    ones in the sorted order.
+    """
+    index = numpy.fromiter((i for i, x in enumerate(strings) if x.isascii()), dtype=numpy.intp)
+    lengths = numpy.fromiter((len(strings[i]) for i in index), dtype=numpy.intp, count=len(index))
+    order = numpy.argsort(-lengths, kind="stable")
+    index = index[order]
+    lengths = lengths[order]
+    data = byte_codes[numpy.frombuffer("".join(strings[i] for i in index).encode("ascii"), dtype=numpy.uint8)]
+    offsets = numpy.zeros(len(index), dtype=numpy.intp)
+    numpy.cumsum(lengths[:-1], out=offsets[1:])
+    active = numpy.searchsorted(-lengths, -numpy.arange(lengths[0] if len(index) else 0), side="left")
+    return index, data, offsets, active
+
+
+class CompiledMachine():
+    def __init__(self, columns, table, accept, names, trap=None):
+        """Initialize a dense transition table engine.
+        columns maps every character of the alphabet to a column,
+        table is a flat array with one row of columns per state, and
+        accept is a bytearray with a 1 for each row that accepts.
+        Characters whose columns are the same in every row are merged
+        into one column, so the table only has a column per class of
+        characters that the machine can't tell apart.
+        Table entries hold the offset of the next row (row * width)
+        rather than the row itself so each step is a single index.
+        names maps each row back to the state number it came from,
+        and trap is the row of the trap state, if the machine has one.
+        table and names are expected to be compact arrays, so a table
+        with millions of rows doesn't hold a Python object per row.
+        Rows that can't reach an accept row (dead rows) are moved to the
+        end of the table, so that the engine can stop on a string as
+        soon as it reaches one with a single comparison.
+        """
+        self.columns = columns
+        # Characters may already share columns, as in a minimized table
+        self.width = len(set(columns.values()))
+        self.table = table
+        self.accept = accept
+        self.names = names
+        # Every way of building a table puts the start state in row 0
+        self.start = 0
+        self.trap = trap
+        self.merge_columns()
+        self.order_dead_rows()
+        # Number of strings that reached a dead row, counted by the runs
+        # that stop there
+        self.rejected_early = 0
+        # NumPy copies of the table, byte columns and accept rows, built
+        # by vectors() the first time a batch is run
+        self.vector_tables = None
+
+    def __getstate__(self):
+        # The NumPy copies are rebuilt when needed, so a cached engine
+        # can still be loaded without NumPy
+        state = dict(self.__dict__)
+        state["vector_tables"] = None
+        return state
+
+    def merge_columns(self):
+        """Groups the columns that lead to the same row from every row
+        into classes, keeps one column per class, and points every
+        character at the column of its class.
+        """
+        width = self.width
+        rows = len(self.names)
+        classes = {}
+        class_of = []
+        for column in range(width):
+            class_of.append(classes.setdefault(self.table[column::width].tobytes(), len(classes)))
+        if len(classes) == width:
+            return
+        # The first column of each class stands for the whole class
+        kept = [class_of.index(x) for x in range(len(classes))]
+        new_width = len(classes)
+        table = array(self.table.typecode, [0]) * (rows * new_width)
+        for row in range(rows):
+            for new_column, column in enumerate(kept):
+                table[row * new_width + new_column] = self.table[row * width + column] // width * new_width
+        self.columns = dict((char, class_of[column]) for char, column in self.columns.items())
+        self.width = new_width
+        self.table = table
+
+    def sources(self, by_column=False):
+        """Returns the table reversed, as two flat arrays first and
+        sources: sources[first[r]:first[r + 1]] lists the rows that move
+        to row r. With by_column, the rows that move to row r on column c
+        are listed at sources[first[k]:first[k + 1]] for k = r * width + c
+        instead. No Python object is made per row.
+        """
+        width = self.width
+        rows = len(self.names)
+        table = self.table
+        keys = rows * width if by_column else rows
+        first = array(compact_typecode(rows * width), [0]) * (keys + 1)
+        for entry, next_offset in enumerate(table):
+            first[(next_offset + entry % width if by_column else next_offset // width) + 1] += 1
+        for key in range(keys):
+            first[key + 1] += first[key]
+        sources = array(compact_typecode(rows), [0]) * (rows * width)
+        filled = array(first.typecode, first)
+        for entry, next_offset in enumerate(table):
+            key = next_offset + entry % width if by_column else next_offset // width
+            sources[filled[key]] = entry // width
+            filled[key] += 1
+        return first, sources
+
+    def order_dead_rows(self):
+        """Finds the rows that can reach an accept row by walking the
+        table backwards from the accept rows, and renumbers the rows so
+        that those live rows come first. Sets live to the number of live
+        rows and dead to the offset of the first dead row. If the start
+        row is dead, nothing reachable can accept and live is 0.
+        """
+        width = self.width
+        rows = len(self.names)
+        table = self.table
+        first, sources = self.sources()
+        live = bytearray(self.accept)
+        pending = array(compact_typecode(rows), (row for row in range(rows) if live[row]))
+        while pending:
+            row = pending.pop()
+            for from_row in sources[first[row]:first[row + 1]]:
+                if not live[from_row]:
+                    live[from_row] = 1
+                    pending.append(from_row)
+        live_count = live.count(1)
+        if not live[self.start]:
+            self.live = 0
+        else:
+            # Only renumber when a dead row comes before a live one
+            if 0 <= live.find(0) < live_count:
+                new_row = array(compact_typecode(rows), [0]) * rows
+                order = array(new_row.typecode, [0]) * rows
+                next_live = 0
+                next_dead = live_count
+                for row in range(rows):
+                    if live[row]:
+                        new_row[row] = next_live
+                        next_live += 1
+                    else:
+                        new_row[row] = next_dead
+                        next_dead += 1
+                    order[new_row[row]] = row
+                new_table = array(table.typecode, [0]) * len(table)
+                accept = bytearray(rows)
+                for row, old_row in enumerate(order):
+                    accept[row] = self.accept[old_row]
+                    for column in range(width):
+                        new_table[row * width + column] = new_row[table[old_row * width + column] // width] * width
+                self.table = new_table
+                self.accept = accept
+                self.names = array(self.names.typecode, (self.names[x] for x in order))
+                if self.trap is not None:
+                    self.trap = new_row[self.trap]
+            self.live = live_count
+        self.dead = self.live * width
+
+    def is_dead(self, row):
+        """Returns True if the given row can't reach an accept row
+        """
+        return row >= self.live
+
+    def is_accept(self, row):
+        """Returns True if the given row is an accept state
+        """
+        return self.accept[row] == 1
+
+    def run(self, input_string, row=0):
+        """Runs a string from the given row and returns the row the
+        machine ends in, or INVALID if the string holds a character
+        outside of the alphabet.
+        """
+        columns = self.columns
+        table = self.table
+        dead = self.dead
+        if row >= self.live:
+            self.rejected_early += 1
+            return row
+        state = row * self.width
+        for input_char in input_string:
+            column = columns.get(input_char)
+            if column is None:
+                return INVALID
+            state = table[state + column]
+            # Stop as soon as the string can no longer be accepted
+            if state >= dead:
+                self.rejected_early += 1
+                return state // self.width
+        return state // self.width if self.width else row
+
+    def accepts(self, input_string):
+        """Returns True if the machine accepts the string from its
+        start state
+        """
+        row = self.run(input_string, self.start)
+        return row != INVALID and self.accept[row] == 1
+
+    def accepts_batch(self, strings):
+        """Runs a whole list of strings through the machine at once and
+        returns a list of booleans, one per string.
+        With NumPy available every string keeps its state in a vector,
+        and each column of characters is advanced with a single gather
+        over the table. Strings are sorted longest first so column j
+        only has to touch the strings that are longer than j.
+        """
+        if load_numpy() is None or not self.width:
+            return [self.accepts(x) for x in strings]
+        index, data, offsets, active = pack_batch(strings, self.byte_columns())
+        # Strings with non ASCII characters are left out of the batch,
+        # run them on their own so they are counted the same way
+        packed = set(index.tolist())
+        for i, input_string in enumerate(strings):
+            if i not in packed:
+                self.run(input_string)
+        accepted = numpy.zeros(len(strings), dtype=bool)
+        accepted[index] = self.run_vectorized(data, offsets, active)
+        return accepted.tolist()
+
+    def vectors(self):
+        """Returns the table, byte columns and accept rows as NumPy arrays.
+        byte_columns maps every byte to its column, with the column
+        `width` marking bytes outside of the alphabet. The arrays are
+        built once per engine and reused by every batch.
+        """
+        if self.vector_tables is None:
+            byte_columns = numpy.full(256, self.width, dtype=numpy.intp)
+            for char, column in self.columns.items():
+                byte_columns[ord(char)] = column
+            self.vector_tables = (numpy.array(self.table, dtype=numpy.intp), byte_columns,
+                                  numpy.frombuffer(bytes(self.accept), dtype=numpy.uint8).astype(bool))
+        return self.vector_tables
+
+    def byte_columns(self):
+        """Returns a NumPy array that maps every byte to its column, with
+        the column `width` marking bytes outside of the alphabet
+        """
+        return self.vectors()[1]
+
+    def run_vectorized(self, data, offsets, active, byte_columns=None):
+        """Runs strings packed into data, one starting at each offset and
+        sorted longest first, through the machine together. Every string
+        keeps its state in a vector, and each column of characters is
+        advanced with a single gather over the table. active[j] is the
+        number of strings longer than j. data holds columns, or bytes
+        that byte_columns maps to columns. Returns whether each string
+        is accepted.
+        """
+        width = self.width
+        table, _, accept_rows = self.vectors()
+        states = numpy.full(len(offsets), self.start * width, dtype=numpy.intp)
+        invalid = numpy.zeros(len(offsets), dtype=bool)
+        # Strings that reached a dead row before any character outside
+        # of the alphabet, which the other modes would have stopped on
+        reached = numpy.full(len(offsets), self.live == 0, dtype=bool)
+        for j, count in enumerate(active):
+            columns = data[offsets[:count] + j]
+            if byte_columns is not None:
+                columns = byte_columns[columns]
+            invalid[:count] |= columns == width
+            states[:count] = table[states[:count] + numpy.minimum(columns, width - 1)]
+            reached[:count] |= (states[:count] >= self.dead) & ~invalid[:count]
+        self.rejected_early += int(reached.sum())
+        return accept_rows[states // width] & ~invalid
+
+    def accepts_spans(self, buffer, starts, ends):
+        """Returns a list of booleans, one per line of a bytes-like buffer,
+        where line i is buffer[starts[i]:ends[i]]. The lines are run
+        straight out of the buffer, without decoding or copying them.
+        Bytes outside of the ASCII alphabet are simply not in any column.
+        """
+        if load_numpy() is not None and self.width:
+            starts = numpy.array(starts, dtype=numpy.intp)
+            lengths = numpy.array(ends, dtype=numpy.intp) - starts
+            order = numpy.argsort(-lengths, kind="stable")
+            lengths = lengths[order]
+            active = numpy.searchsorted(-lengths, -numpy.arange(lengths[0] if len(order) else 0), side="left")
+            accepted = numpy.zeros(len(order), dtype=bool)
+            accepted[order] = self.run_vectorized(numpy.frombuffer(buffer, dtype=numpy.uint8), starts[order],
+                                                  active, self.byte_columns())
+            return accepted.tolist()
+        byte_columns = [None] * 256
+        for char, column in self.columns.items():
+            byte_columns[ord(char)] = column
+        view = memoryview(buffer)
+        table = self.table
+        width = self.width
+        dead = self.dead
+        accepted = []
+        # The start row is checked on its own, as with no columns every
+        # offset is 0 and so is dead
+        start_dead = self.is_dead(self.start)
+        for start, end in zip(starts, ends):
+            state = self.start * width
+            if start_dead:
+                self.rejected_early += 1
+                accepted.append(False)
+                continue
+            for byte in view[start:end]:
+                column = byte_columns[byte]
+                if column is None:
+                    state = INVALID
+                    break
+                state = table[state + column]
+                if state >= dead:
+                    self.rejected_early += 1
+                    break
+            accepted.append(state != INVALID and self.accept[state // width if width else self.start] == 1)
+        return accepted
+
+    def accepts_shared(self, strings):
+        """Runs a list of strings in sorted order, sharing the work on
+        common prefixes the same way shared_prefix_walk does, but
+        stepping through the table directly. path holds row offsets.
+        """
+        if not self.width:
+            return [self.accepts(x) for x in strings]
+        columns = self.columns
+        table = self.table
+        width = self.width
+        dead = self.dead
+        accepted = [False] * len(strings)
+        previous = ""
+        path = [self.start * width]
+        for i in sorted(range(len(strings)), key=strings.__getitem__):
+            input_string = strings[i]
+            shared = min(common_prefix_length(previous, input_string), len(path) - 1)
+            del path[shared + 1:]
+            state = path[shared]
+            if state >= dead:
+                self.rejected_early += 1
+            elif state != INVALID:
+                for input_char in input_string[shared:]:
+                    column = columns.get(input_char)
+                    if column is None:
+                        state = INVALID
+                        path.append(state)
+                        break
+                    state = table[state + column]
+                    path.append(state)
+                    if state >= dead:
+                        self.rejected_early += 1
+                        break
+                else:
+                    accepted[i] = self.accept[state // width] == 1
+            previous = input_string
+        return accepted
+
+    def minimize(self):
+        """Returns an equivalent CompiledMachine with the fewest states.
+        Rows that can't be reached from the start row are dropped, then
+        the remaining rows are grouped with Hopcroft's partition
+        refinement, starting from the accept and reject rows and
+        splitting blocks until every row in a block behaves the same.
+        """
+        width = self.width
+        table = self.table
+        # Find every row reachable from the start row
+        reachable = set([self.start])
+        pending = [self.start]
+        while pending:
+            row = pending.pop()
+            for column in range(width):
+                next_row = table[row * width + column] // width
+                if next_row not in reachable:
+                    reachable.add(next_row)
+                    pending.append(next_row)
+        # inverse[column][row] lists the rows that move to row on column
+        inverse = [{} for column in range(width)]
+        for row in reachable:
+            for column in range(width):
+                inverse[column].setdefault(table[row * width + column] // width, []).append(row)
+        accepting = set(row for row in reachable if self.is_accept(row))
+        blocks = [block for block in (accepting, reachable - accepting) if block]
+        block_of = {}
+        for block_id, block in enumerate(blocks):
+            for row in block:
+                block_of[row] = block_id
+        waiting = set([min(range(len(blocks)), key=lambda x: len(blocks[x]))])
+        while waiting:
+            splitter = set(blocks[waiting.pop()])
+            for column in range(width):
+                # Group the rows leading into the splitter by block
+                touched = {}
+                for row in splitter:
+                    for from_row in inverse[column].get(row, ()):
+                        touched.setdefault(block_of[from_row], set()).add(from_row)
+                for block_id, inside in touched.items():
+                    if len(inside) == len(blocks[block_id]):
+                        continue
+                    # Split the block and keep waiting on the smaller half
+                    # unless the whole block was already waiting
+                    blocks[block_id] -= inside
+                    new_id = len(blocks)
+                    blocks.append(inside)
+                    for row in inside:
+                        block_of[row] = new_id
+                    if block_id in waiting or len(inside) <= len(blocks[block_id]):
+                        waiting.add(new_id)
+                    else:
+                        waiting.add(block_id)
+        # Rebuild the table with the start block as row 0 and the other
+        # blocks ordered by the lowest row they hold
+        order = sorted(range(len(blocks)), key=lambda x: (self.start not in blocks[x], min(blocks[x])))
+        new_row = dict((block_id, row) for row, block_id in enumerate(order))
+        new_table = array(self.table.typecode, [0]) * (len(order) * width)
+        accept = bytearray(len(order))
+        names = array(self.names.typecode)
+        for row, block_id in enumerate(order):
+            old_row = min(blocks[block_id])
+            names.append(self.names[old_row])
+            accept[row] = self.accept[old_row]
+            for column in range(width):
+                new_table[row * width + column] = new_row[block_of[table[old_row * width + column] // width]] * width
+        trap = None
+        if self.trap is not None and self.trap in block_of:
+            trap = new_row[block_of[self.trap]]
+        return CompiledMachine(self.columns, new_table, accept, names, trap)
+
+
+def row_branches(engine):
+    """Returns, for each live row of a dense engine, a list of the rows
+    it moves to paired with the characters leading to each of them,
+    the biggest groups of characters first
+    """
+    width = engine.width
+    # Several characters can share a column
+    chars_of = [[] for column in range(width)]
+    for char in sorted(engine.columns):
+        chars_of[engine.columns[char]].append(char)
+    branches = {}
+    for row in range(engine.live):
+        groups = {}
+        for column, chars_in_column in enumerate(chars_of):
+            groups.setdefault(engine.table[row * width + column] // width, []).extend(chars_in_column)
+        branches[row] = sorted(groups.items(), key=lambda x: (-len(x[1]), x[0]))
+    return branches
+
+
+def generated_tests(engine, branches):
+    """Returns the number of comparisons the code generate_source makes
+    for a character, averaged over the live rows and the characters of
+    the alphabet: the ones finding the branch of the row, then one per
+    group of characters until the one holding the character
+    """
+    if not engine.live or not engine.columns:
+        return 0
+    tests = (engine.live - 1).bit_length()
+    for row in range(engine.live):
+        for number, (next_row, group) in enumerate(branches[row]):
+            tests += (number + 1) * len(group) / len(engine.columns) / engine.live
+    return tests
+
+
+def generate_source(engine):
+    """Returns the source of two Python functions specialized to a dense
+    engine, run and accepts, which behave like the methods of the same
+    name on CompiledMachine. Every live row becomes a branch on the
+    current state holding one test per group of characters leading to
+    the same row, so there are no table or dict lookups left. The
+    branches are nested by halves of the rows, so finding the branch
+    of a row takes about log2(rows) comparisons. Moving to
+    a dead row returns right away and counts the string as rejected
+    early on the engine the functions are loaded for.
+    """
+    rows = len(engine.names)
+    live = engine.live
+    # The biggest groups of characters are tested first
+    branches = row_branches(engine)
+
+    def body(lines, accepts):
+        lines.append("    if state >= {}:".format(live))
+        lines.append("        engine.rejected_early += 1")
+        lines.append("        return {}".format("False" if accepts else "state"))
+        if not live:
+            # Every string is rejected by the check above
+            return
+        lines.append("    for c in input_string:")
+
+        def dispatch(first, last, indent):
+            # Branch on the rows first to last - 1 by halving the range,
+            # so a step costs a few comparisons however many rows there are
+            if last - first > 1:
+                middle = (first + last) // 2
+                lines.append("{}if state < {}:".format(indent, middle))
+                dispatch(first, middle, indent + "    ")
+                lines.append("{}else:".format(indent))
+                dispatch(middle, last, indent + "    ")
+                return
+            for number, (next_row, group) in enumerate(branches[first]):
+                test = "c == {!r}".format(group[0]) if len(group) == 1 else "c in {!r}".format("".join(group))
+                lines.append("{}{} {}:".format(indent, "if" if number == 0 else "elif", test))
+                if next_row >= live:
+                    lines.append("{}    engine.rejected_early += 1".format(indent))
+                    lines.append("{}    return {}".format(indent, "False" if accepts else next_row))
+                elif next_row != first:
+                    lines.append("{}    state = {}".format(indent, next_row))
+                else:
+                    # Staying on the same row
+                    lines.append("{}    pass".format(indent))
+            if branches[first]:
+                lines.append("{}else:".format(indent))
+                lines.append("{}    return {}".format(indent, "False" if accepts else INVALID))
+            else:
+                lines.append("{}return {}".format(indent, "False" if accepts else INVALID))
+
+        dispatch(0, live, "        ")
+
+    lines = ["def run(input_string, state={}):".format(engine.start)]
+    body(lines, False)
+    lines.append("    return state")
+    lines.append("")
+    lines.append("def accepts(input_string):")
+    lines.append("    state = {}".format(engine.start))
+    body(lines, True)
+    accepting = [row for row in range(rows) if engine.is_accept(row)]
+    if accepting:
+        lines.append("    return state in {{{}}}".format(", ".join(str(x) for x in accepting)))
+    else:
+        lines.append("    return False")
+    return "\n".join(lines) + "\n"
+
+
+class GeneratedMachine():
+    def __init__(self, compiled):
+        """Initialize an engine that runs Python code generated from a
+        CompiledMachine by generate_source. Rows, accept states and
+        everything else are the same as in the CompiledMachine, which is
+        kept for the operations that don't have generated code.
+        The generated functions aren't pickled with the rest of the
+        engine, they are compiled again from the source on loading.
+        """
+        self.compiled = compiled
+        self.columns = compiled.columns
+        self.width = compiled.width
+        self.accept = compiled.accept
+        self.names = compiled.names
+        self.start = compiled.start
+        self.trap = compiled.trap
+        self.live = compiled.live
+        self.rejected_early = 0
+        self.source = generate_source(compiled)
+        self.load()
+
+    def load(self):
+        """Compiles the generated source into the run and accepts
+        functions of this engine
+        """
+        namespace = {"engine": self}
+        exec(compile(self.source, "<generated machine>", "exec"), namespace)
+        self.run = namespace["run"]
+        self.accepts = namespace["accepts"]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["run"]
+        del state["accepts"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.load()
+
+    def is_accept(self, row):
+        """Returns True if the given row is an accept state
+        """
+        return self.accept[row] == 1
+
+    def is_dead(self, row):
+        """Returns True if the given row can't reach an accept row
+        """
+        return row >= self.live
+
+    def accepts_batch(self, strings):
+        """Returns a list of booleans, one per string
+        """
+        return list(map(self.accepts, strings))
+
+    def accepts_shared(self, strings):
+        """Returns a list of booleans, one per string, sharing the work
+        on common prefixes through the table of the compiled machine
+        """
+        before = self.compiled.rejected_early
+        accepted = self.compiled.accepts_shared(strings)
+        self.rejected_early += self.compiled.rejected_early - before
+        return accepted
+
+    def accepts_spans(self, buffer, starts, ends):
+        """Returns a list of booleans, one per line of buffer. The
+        generated code runs on strings, so each line is decoded first.
+        """
+        return self.accepts_batch(decode_spans(buffer, starts, ends))
+
+    def minimize(self):
+        """Returns a GeneratedMachine for the minimized table
+        """
+        return GeneratedMachine(self.compiled.minimize())
+
+
+class BitsetMachine():
+    def __init__(self, columns, moves, accept, start, names):
+        """Initialize a bit parallel NFA engine.
+        columns maps every character of the alphabet to a column, and
+        moves[column][s] is the epsilon closed set of states that state s
+        moves to on that column, as a bitmask. accept and start are also
+        bitmasks, and names lists the NFA states.
+        An engine state is the set of NFA states the machine is in.
+        States that can't reach an accept state are expected to be left
+        out of moves and start, so the empty set means the string can't
+        be accepted any more.
+        Characters that move every state to the same set share a
+        column, just like in CompiledMachine.
+        """
+        classes = {}
+        class_of = []
+        for move in moves:
+            class_of.append(classes.setdefault(tuple(move), len(classes)))
+        self.columns = dict((char, class_of[column]) for char, column in columns.items())
+        self.moves = [list(x) for x in classes]
+        self.accept = accept
+        self.start = start
+        self.names = names
+        # Number of strings that ended up with no live states left
+        self.rejected_early = 0
+
+    def is_accept(self, states):
+        """Returns True if any of the given states is an accept state
+        """
+        return self.accept & states != 0
+
+    def is_dead(self, states):
+        """Returns True if no state in the set can reach an accept state
+        """
+        return states == 0
+
+    def step(self, states, column):
+        """Returns the set of states the given set moves to on a column
+        """
+        move = self.moves[column]
+        next_states = 0
+        while states:
+            low = states & -states
+            next_states |= move[low.bit_length() - 1]
+            states ^= low
+        return next_states
+
+    def run(self, input_string, states=None):
+        """Runs a string from the given set of states and returns the
+        set the machine ends in, or INVALID if the string holds a
+        character outside of the alphabet.
+        """
+        columns = self.columns
+        moves = self.moves
+        if states is None:
+            states = self.start
+        if not states:
+            self.rejected_early += 1
+            return states
+        for input_char in input_string:
+            column = columns.get(input_char)
+            if column is None:
+                return INVALID
+            move = moves[column]
+            # OR together the successors of every state in the set,
+            # peeling off the lowest set bit each time
+            next_states = 0
+            while states:
+                low = states & -states
+                next_states |= move[low.bit_length() - 1]
+                states ^= low
+            states = next_states
+            # Stop as soon as no live states are left
+            if not states:
+                self.rejected_early += 1
+                return states
+        return states
+
+    def accepts(self, input_string):
+        """Returns True if the machine accepts the string from its
+        start states
+        """
+        states = self.run(input_string)
+        return states != INVALID and self.accept & states != 0
+
+    def accepts_batch(self, strings):
+        """Returns a list of booleans, one per string
+        """
+        return [self.accepts(x) for x in strings]
+
+    def accepts_shared(self, strings):
+        """Returns a list of booleans, one per string, sharing the work
+        on common prefixes
+        """
+        return shared_prefix_walk(self, strings)
+
+    def accepts_spans(self, buffer, starts, ends):
+        """Returns a list of booleans, one per line of buffer. Sets of
+        states are stepped one character at a time anyway, so each line
+        is decoded first.
+        """
+        return self.accepts_batch(decode_spans(buffer, starts, ends))
+
+    def minimize(self):
+        """An NFA can't be minimized without determinizing it, which
+        is what this engine is there to avoid, so it is returned as is.
+        """
+        return self
+
 
-input_count = 0
-for machine_file in os.listdir(os.path.join(os.path.dirname(__file__),"machine_files")):
+class LazyMachine():
+    def __init__(self, nfa, cache_size=LAZY_CACHE_SIZE):
+        """Initialize a lazy DFA engine on top of a BitsetMachine.
+        DFA states are sets of NFA states, and are only built when the
+        input reaches them. They are cached along with the transitions
+        between them, so most characters cost a single table lookup.
+        Once cache_size states are cached the cache is flushed and built
+        up again, which keeps memory bounded. If the cache keeps getting
+        flushed without much input going through it, the engine stops
+        caching and leaves every string to the NFA.
+        Engine states are the NFA state sets, just like BitsetMachine,
+        so they stay valid across flushes.
+        """
+        self.nfa = nfa
+        self.columns = nfa.columns
+        self.width = len(nfa.moves)
+        self.accept = nfa.accept
+        self.start = nfa.start
+        self.names = nfa.names
+        self.cache_size = max(cache_size, 2)
+        self.flushes = 0
+        self.thrashing = False
+        self.seen = 0
+        self.seen_at_flush = 0
+        self.thrash_count = 0
+        self.rejected_early = 0
+        self.flush()
+
+    def flush(self):
+        """Empties the cache of DFA states
+        """
+        # ids maps a set of NFA states to its id in the cache, masks
+        # maps it back, and table holds the id each id moves to on each
+        # column, -1 if that transition hasn't been worked out yet, or
+        # -2 if it leads to the empty set
+        self.ids = {}
+        self.masks = []
+        self.table = []
+
+    def state_id(self, states):
+        """Returns the cache id of a set of NFA states, adding it to the
+        cache (and flushing the cache first if it is full) if needed
+        """
+        state = self.ids.get(states)
+        if state is None:
+            if len(self.masks) >= self.cache_size:
+                self.flushes += 1
+                # Flushing again before enough input went through the
+                # cache means the cache isn't paying for itself
+                if self.seen - self.seen_at_flush < LAZY_MIN_CHARS * self.cache_size:
+                    self.thrash_count += 1
+                    if self.thrash_count >= LAZY_THRASH_LIMIT:
+                        self.thrashing = True
+                self.seen_at_flush = self.seen
+                self.flush()
+            state = len(self.masks)
+            self.ids[states] = state
+            self.masks.append(states)
+            self.table.extend([-1] * self.width)
+        return state
+
+    def is_accept(self, states):
+        """Returns True if any of the given states is an accept state
+        """
+        return self.accept & states != 0
+
+    def is_dead(self, states):
+        """Returns True if no state in the set can reach an accept state
+        """
+        return states == 0
+
+    def run(self, input_string, states=None):
+        """Runs a string from the given set of NFA states and returns the
+        set the machine ends in, or INVALID if the string holds a
+        character outside of the alphabet.
+        """
+        if states is None:
+            states = self.start
+        if self.thrashing:
+            before = self.nfa.rejected_early
+            states = self.nfa.run(input_string, states)
+            self.rejected_early += self.nfa.rejected_early - before
+            return states
+        if not states:
+            self.rejected_early += 1
+            return states
+        self.seen += len(input_string)
+        columns = self.columns
+        width = self.width
+        # Looking the start set up may flush the cache, so the table is
+        # only read once it has its id
+        state = self.state_id(states)
+        table = self.table
+        for input_char in input_string:
+            column = columns.get(input_char)
+            if column is None:
+                return INVALID
+            next_state = table[state * width + column]
+            if next_state < 0:
+                if next_state == -2:
+                    self.rejected_early += 1
+                    return 0
+                # Work the transition out with the NFA and cache it. The
+                # cache may be flushed on the way, which drops every id
+                # but the one we get back
+                next_states = self.nfa.step(self.masks[state], column)
+                if not next_states:
+                    table[state * width + column] = -2
+                    self.rejected_early += 1
+                    return 0
+                flushes = self.flushes
+                next_state = self.state_id(next_states)
+                table = self.table
+                if flushes == self.flushes:
+                    table[state * width + column] = next_state
+            state = next_state
+        return self.masks[state]
+
+    def accepts(self, input_string):
+        """Returns True if the machine accepts the string from its
+        start states
+        """
+        states = self.run(input_string)
+        return states != INVALID and self.accept & states != 0
+
+    def accepts_batch(self, strings):
+        """Returns a list of booleans, one per string
+        """
+        return [self.accepts(x) for x in strings]
+
+    def accepts_shared(self, strings):
+        """Returns a list of booleans, one per string, sharing the work
+        on common prefixes
+        """
+        return shared_prefix_walk(self, strings)
+
+    def accepts_spans(self, buffer, starts, ends):
+        """Returns a list of booleans, one per line of buffer. Sets of
+        states are stepped one character at a time anyway, so each line
+        is decoded first.
+        """
+        return self.accepts_batch(decode_spans(buffer, starts, ends))
+
+    def minimize(self):
+        """The cached states only cover the input seen so far, so there
+        is nothing to minimize and the engine is returned as is.
+        """
+        return self
+
+
+class Cursor():
+    def __init__(self, engine, state=None):
+        """Initialize a handle on a string being fed through an engine a
+        chunk at a time. Only the engine state reached so far is kept,
+        so a cursor is cheap and never runs a chunk twice. state is
+        where to start from, the start state of the engine by default.
+        """
+        self.engine = engine
+        self.state = engine.start if state is None else state
+
+    def feed(self, chunk):
+        """Runs the next chunk of the string from where the cursor is.
+        Once the string can't be accepted any more, because of a
+        character outside of the alphabet or a dead state, the rest of
+        the string is skipped. Returns the cursor so calls can be chained.
+        """
+        if not self.rejected:
+            self.state = self.engine.run(chunk, self.state)
+        return self
+
+    @property
+    def accepting(self):
+        """True if the machine accepts the string fed so far
+        """
+        return self.state != INVALID and self.engine.is_accept(self.state)
+
+    @property
+    def rejected(self):
+        """True if no matter what is fed next, the string won't be
+        accepted
+        """
+        return self.state == INVALID or self.engine.is_dead(self.state)
+
+    def copy(self):
+        """Returns a new cursor at the same point, so the string can be
+        carried on in two different ways without running it again
+        """
+        return Cursor(self.engine, self.state)
+
+    def reset(self):
+        """Moves the cursor back to the start state
+        """
+        self.state = self.engine.start
+
+
+class Scanner():
+    def __init__(self, engine, cache_size=LAZY_CACHE_SIZE):
+        """Initialize a scanner that finds the substrings of a line that
+        an engine accepts. The engine is looked at as an NFA over bitsets
+        of states: the rows of a dense engine become states with a single
+        successor each, and the NFA engines are used as they are.
+        Lines are read backwards through an unanchored DFA, built lazily
+        from the reversed NFA, that marks every position a match starts
+        at. Its states are cached like the ones of LazyMachine, and the
+        cache is emptied once it holds cache_size of them.
+        """
+        if isinstance(engine, GeneratedMachine):
+            engine = engine.compiled
+        elif isinstance(engine, LazyMachine):
+            engine = engine.nfa
+        self.engine = engine
+        self.columns = engine.columns
+        self.dense = isinstance(engine, CompiledMachine)
+        if self.dense:
+            # A table of bitsets, one per row and column, would grow with
+            # the square of the rows, so dense engines step back through
+            # their reversed table instead, which is the size of the table
+            self.width = engine.width
+            self.rows = len(engine.names)
+            self.first, self.sources = engine.sources(by_column=True)
+            self.start = 1 << engine.start
+            bits = bytearray((self.rows + 7) // 8)
+            for row in range(self.rows):
+                if engine.is_accept(row):
+                    bits[row >> 3] |= 1 << (row & 7)
+            self.accept = int.from_bytes(bits, "little")
+        else:
+            self.width = len(engine.moves)
+            self.start = engine.start
+            self.accept = engine.accept
+            # back[column][t] is the set of states that move to state t
+            # on that column
+            self.back = []
+            for move in engine.moves:
+                back = [0] * len(move)
+                for from_state, to_states in enumerate(move):
+                    while to_states:
+                        low = to_states & -to_states
+                        back[low.bit_length() - 1] |= 1 << from_state
+                        to_states ^= low
+                self.back.append(back)
+        self.cache_size = max(cache_size, 1)
+        self.cache = {}
+
+    def step_back(self, states, column):
+        """Returns the set of states that move into the given set on a
+        column, caching the result
+        """
+        steps = self.cache.get(states)
+        if steps is None:
+            if len(self.cache) >= self.cache_size:
+                self.cache = {}
+            steps = self.cache[states] = [None] * self.width
+        previous = steps[column]
+        if previous is None and self.dense:
+            first = self.first
+            sources = self.sources
+            width = self.width
+            bits = bytearray((self.rows + 7) // 8)
+            for index, byte in enumerate(states.to_bytes((states.bit_length() + 7) // 8, "little")):
+                while byte:
+                    low = byte & -byte
+                    key = ((index << 3) + low.bit_length() - 1) * width + column
+                    for from_row in sources[first[key]:first[key + 1]]:
+                        bits[from_row >> 3] |= 1 << (from_row & 7)
+                    byte ^= low
+            previous = steps[column] = int.from_bytes(bits, "little")
+        elif previous is None:
+            back = self.back[column]
+            previous = 0
+            pending = states
+            while pending:
+                low = pending & -pending
+                previous |= back[low.bit_length() - 1]
+                pending ^= low
+            steps[column] = previous
+        return previous
+
+    def match_starts(self, line):
+        """Returns, in order, every position of the line that a non empty
+        match starts at. The line is read once, from its end: states is
+        the set of states that can reach an accept state on what comes
+        after the current position.
+        """
+        columns = self.columns
+        accept = self.accept
+        start = self.start
+        starts = []
+        states = accept
+        for position in range(len(line) - 1, -1, -1):
+            column = columns.get(line[position])
+            if column is None:
+                # Nothing can match across a character outside of the
+                # alphabet
+                states = accept
+                continue
+            previous = self.step_back(states, column)
+            if previous & start:
+                starts.append(position)
+            states = previous | accept
+        starts.reverse()
+        return starts
+
+    def matches(self, line):
+        """Yields the start and end of every leftmost longest match in the
+        line, leaving out empty matches. After a match, the search goes
+        on from where the match ended.
+        The line is read forwards once, after match_starts. Every start
+        that could be the next match if the matches before it ended where
+        they have so far gets an entry [start, state, end, index] in
+        chain, index being where it is in chain, and
+        each entry runs on its own state until it dies. An entry reaching
+        a state an earlier one is in has the same future from there on,
+        so it stops running: if that future accepts, the earlier match
+        grows past both starts and every later entry is dropped anyway,
+        and otherwise its end is already known.
+        """
+        engine = self.engine
+        starts = self.match_starts(line)
+        next_start = 0
+        chain = []
+        head = 0
+        # The entries still running, in order of their starts, and the
+        # state each of them is in
+        running = []
+        states = {}
+        for position in range(len(line) + 1):
+            if next_start < len(starts) and starts[next_start] == position:
+                next_start += 1
+                if not chain or (chain[-1][2] is not None and chain[-1][2] <= position):
+                    entry = [position, engine.start, None, len(chain)]
+                    chain.append(entry)
+                    if engine.start in states:
+                        entry[1] = None
+                    else:
+                        states[engine.start] = entry
+                        running.append(entry)
+            # The first entry is done once it stops running, and so is
+            # every stopped entry after it
+            while head < len(chain) and chain[head][1] is None:
+                if chain[head][2] is not None:
+                    yield chain[head][0], chain[head][2]
+                head += 1
+            if position == len(line):
+                break
+            input_char = line[position]
+            states = {}
+            still_running = []
+            accepted = None
+            for entry in running:
+                state = engine.run(input_char, entry[1])
+                if state == INVALID or engine.is_dead(state) or state in states:
+                    entry[1] = None
+                    continue
+                entry[1] = state
+                states[state] = entry
+                still_running.append(entry)
+                if engine.is_accept(state):
+                    entry[2] = position + 1
+                    if accepted is None:
+                        accepted = entry
+            running = still_running
+            if accepted is not None and accepted is not chain[-1]:
+                # Every later entry starts inside the match that grew
+                del chain[accepted[3] + 1:]
+                running = [x for x in running if x[3] <= accepted[3]]
+                states = dict((x[1], x) for x in running)
+        for entry in chain[head:]:
+            if entry[2] is not None:
+                yield entry[0], entry[2]
+
+
+def scan_file(machine, path):
+    """Yields the start and end offset and the text of every leftmost
+    longest match of the machine in a file. No character of an alphabet
+    is a newline, so matches never span lines, and each line is sliced
+    out of a memory map of the file and scanned on its own.
+    """
+    if os.path.getsize(path) == 0:
+        return
+    scanner = Scanner(machine.engine)
+    with open(path, "rb") as scanned_file:
+        with mmap.mmap(scanned_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = 0
+            while position < len(data):
+                starts, ends, position = line_spans(data, position, len(data))
+                for line_start, line_end in zip(starts, ends):
+                    # Latin-1 keeps one character per byte, so positions
+                    # in the line are byte offsets
+                    line = data[line_start:line_end].decode("latin-1")
+                    for start, end in scanner.matches(line):
+                        yield line_start + start, line_start + end, line[start:end]
+
+
+def file_digest(path):
+    """Returns the SHA-256 hex digest of a file's contents, or None if
+    the file can't be read
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as hashed_file:
+            for block in iter(lambda: hashed_file.read(1 << 20), b""):
+                digest.update(block)
+    except IOError:
+        return None
+    return digest.hexdigest()
+
+
+def read_manifest(manifest_path):
+    """Returns the manifest of a results directory, which maps each
+    machine file to the key its results were computed with and the
+    result files written for it
+    """
     try:
-        machine = Machine(os.path.join(os.path.dirname(__file__),os.path.join(os.path.join(os.path.dirname(__file__),"machine_files"), machine_file)))    
-        if machine.machine_type == "DFA":
-            with open(os.path.join(os.path.dirname(__file__), "input.txt"), "r") as input_file:
-                input_count = 0
-                for input_string in input_file:
-                    input_string = input_string.strip()
-                    machine.reset_machine()
-                    machine.run_machine(input_string)
-                    input_count += 1
-                
-            with open(os.path.join(os.path.join(os.path.dirname(__file__),"results"),"{}.txt".format(machine_file.replace(".fa",""))), "w+") as lang_file:
-                for string in machine.language:
-                    lang_file.write("{}\n".format(string))
-            with open(os.path.join(os.path.join(os.path.dirname(__file__),"results"),"{}.log".format(machine_file.replace(".fa",""))), "w+") as log_file:
-                log_file.write("Valid: {}\n".format(machine.machine_type))
-                log_file.write("States: {}\n".format(len(machine.states)))
-                log_file.write("Alphabet: {}\n".format(''.join(sorted(machine.alphabet))))
-                log_file.write("Accepted Strings: {} / {}\n".format(len(machine.language), input_count))
+        with open(manifest_path, "r") as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_manifest(manifest_path, manifest):
+    """Writes the manifest of a results directory
+    """
+    temp_path = "{}.tmp".format(manifest_path)
+    with open(temp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def load_machine(machine_path, args):
+    """Returns the Machine for a machine file. If a cache directory was
+    given, compiled machines are looked up there by the hash of the
+    machine file and the engine options, and added to it when missing.
+    """
+    if not args.cache:
+        return Machine(machine_path, args.engine, args.lazy_cache, args.max_state, args.trap_state)
+    with open(machine_path, "rb") as machine_file:
+        digest = hashlib.sha256(machine_file.read())
+    digest.update("{}:{}:{}:{}:{}".format(ENGINE_VERSION, args.engine, args.lazy_cache, args.max_state,
+                                          args.trap_state).encode())
+    cache_path = os.path.join(args.cache, "{}.machine".format(digest.hexdigest()))
+    try:
+        return Machine.load_compiled(cache_path)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        # Not cached yet, or the entry is unreadable, so parse the
+        # machine file and cache it
+        pass
+    machine = Machine(machine_path, args.engine, args.lazy_cache, args.max_state, args.trap_state)
+    if not os.path.exists(args.cache):
+        os.makedirs(args.cache, exist_ok=True)
+    machine.save_compiled(cache_path)
+    return machine
+
+
+def run_input(machine, input_path, trie=False):
+    """Runs every line of the input file through the machine, adding
+    the accepted lines to its language. Returns the number of lines.
+    With trie set, each batch is walked in sorted order so shared
+    prefixes are only run once.
+    """
+    run_batch = machine.accepts_shared if trie else machine.accepts_batch
+    with open(input_path, "r") as input_file:
+        input_count = 0
+        # Run the input through the machine a batch of lines
+        # at a time rather than one line at a time
+        while True:
+            batch = [input_string.strip() for input_string in islice(input_file, BATCH_SIZE)]
+            if not batch:
+                break
+            for input_string, accepted in zip(batch, run_batch(batch)):
+                if accepted:
+                    machine.language.append(input_string)
+            input_count += len(batch)
+    return input_count
+
+
+def profile_strings(engine, strings, stats):
+    """Steps each string through the engine one character at a time,
+    stopping where the engine would, and adds to the counters in stats:
+    the transitions taken, the number of times the trap state was
+    entered, the strings given up on for a character outside of the
+    alphabet, and how often each state was visited. For the NFA engines
+    the trap state is the empty set, and a visit to a set of states
+    counts as a visit to every state in it.
+    This is a separate pass so that the engines don't pay for any of
+    the counting when the input is run through them for real.
+    """
+    rejected_early = engine.rejected_early
+    visits = stats["visits"]
+    trap = getattr(engine, "trap", 0)
+    nfa = isinstance(engine, (BitsetMachine, LazyMachine))
+
+    def visit(state):
+        if nfa:
+            while state:
+                low = state & -state
+                visits[low.bit_length() - 1] = visits.get(low.bit_length() - 1, 0) + 1
+                state ^= low
+        else:
+            visits[engine.names[state]] = visits.get(engine.names[state], 0) + 1
+
+    for input_string in strings:
+        state = engine.start
+        visit(state)
+        for input_char in input_string:
+            if engine.is_dead(state):
+                break
+            next_state = engine.run(input_char, state)
+            if next_state == INVALID:
+                stats["alphabet_rejections"] += 1
+                break
+            stats["transitions"] += 1
+            if next_state == trap and state != trap:
+                stats["trap_entries"] += 1
+            state = next_state
+            visit(state)
+    # The runs above aren't real runs, so they don't count
+    engine.rejected_early = rejected_early
+
+
+def profile_input(engine, input_path):
+    """Runs every line of the input file through profile_strings and
+    returns the counters
+    """
+    stats = {"transitions": 0, "trap_entries": 0, "alphabet_rejections": 0, "visits": {}}
+    with open(input_path, "r") as input_file:
+        while True:
+            batch = [input_string.strip() for input_string in islice(input_file, BATCH_SIZE)]
+            if not batch:
+                break
+            profile_strings(engine, batch, stats)
+    return stats
+
 
+class LanguageWriter():
+    def __init__(self, path):
+        """Initialize a writer that stands in for the language list of a
+        machine. Every string appended goes straight to a buffered file
+        at path, and only the number of strings is kept, so memory
+        doesn't grow with the number of accepted strings.
+        """
+        self.language_file = open(path, "w+", buffering=1 << 20)
+        self.count = 0
+
+    def append(self, string):
+        """Writes a string to the language file
+        """
+        self.language_file.write("{}\n".format(string))
+        self.count += 1
+
+    def extend(self, strings):
+        """Writes every string to the language file
+        """
+        for string in strings:
+            self.append(string)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Flushes and closes the language file
+        """
+        self.language_file.close()
+
+
+def stream_language(machine, machine_file):
+    """Replaces the language of a machine with a LanguageWriter for its
+    file in results
+    """
+    machine.language = LanguageWriter(os.path.join(os.path.join(os.path.dirname(__file__),"results"),
+                                                    "{}.txt".format(machine_file.replace(".fa",""))))
+
+
+def line_spans(data, position, end, limit=BATCH_SIZE):
+    """Finds up to limit lines in data between position and end, using
+    find to jump from one newline to the next. Returns where each line
+    starts and ends, leaving out the whitespace str.strip would remove,
+    and the position just past the last line found.
+    With NumPy available the newlines in a window of data are found and
+    the lines stripped with a few vector operations instead.
+    """
+    if load_numpy() is not None:
+        return line_spans_vectorized(data, position, end, limit)
+    starts = []
+    ends = []
+    find = data.find
+    while position < end and len(starts) < limit:
+        newline = find(b"\n", position, end)
+        if newline < 0:
+            newline = end
+        start = position
+        stop = newline
+        while start < stop and data[start] in WHITESPACE:
+            start += 1
+        while stop > start and data[stop - 1] in WHITESPACE:
+            stop -= 1
+        starts.append(start)
+        ends.append(stop)
+        position = newline + 1
+    return starts, ends, position
+
+
+def line_spans_vectorized(data, position, end, limit=BATCH_SIZE):
+    """Same as line_spans, using NumPy on a zero copy view of data
+    """
+    buf = numpy.frombuffer(data, dtype=numpy.uint8)
+    window = min(end, position + MAP_WINDOW)
+    stops = numpy.flatnonzero(buf[position:window] == 10)[:limit] + position
+    if len(stops) == 0 and window < end:
+        # A line longer than the window
+        newline = data.find(b"\n", window, end)
+        stops = numpy.array([newline if newline >= 0 else end], dtype=numpy.intp)
+    next_position = int(stops[-1]) + 1 if len(stops) else position
+    if len(stops) < limit and window == end and next_position < end:
+        # The last line of the file doesn't end with a newline
+        stops = numpy.append(stops, end)
+        next_position = end
+    starts = numpy.empty(len(stops), dtype=numpy.intp)
+    if len(stops):
+        starts[0] = position
+        starts[1:] = stops[:-1] + 1
+    whitespace = numpy.zeros(256, dtype=bool)
+    whitespace[list(WHITESPACE)] = True
+    # Strip the ends of every line one byte at a time, which only takes
+    # as many steps as the longest run of whitespace
+    while True:
+        move = (starts < stops) & whitespace[buf[numpy.minimum(starts, len(buf) - 1)]]
+        if not move.any():
+            break
+        starts += move
+    while True:
+        move = (stops > starts) & whitespace[buf[numpy.maximum(stops - 1, 0)]]
+        if not move.any():
+            break
+        stops -= move
+    return starts, stops, next_position
+
+
+def plain_region(data, start, end):
+    """Returns True if data[start:end] is ASCII and holds no carriage
+    return, in which case splitting it on newlines and stripping ASCII
+    whitespace gives the same lines as reading it in text mode
+    """
+    region = data[start:end]
+    return region.isascii() and b"\r" not in region
+
+
+def text_lines(data, start, end):
+    """Returns the lines of data[start:end] decoded, split and stripped
+    exactly like reading them in text mode does, where a carriage
+    return on its own also ends a line, and str.strip removes non ASCII
+    whitespace as well
+    """
+    return [x.strip() for x in io.StringIO(data[start:end].decode("utf-8", "replace"), newline=None)]
+
+
+def run_mapped(machine, input_path, trie=False):
+    """Same as run_input, but maps the input file into memory and hands
+    the engine the bounds of each line rather than decoded strings.
+    Only the accepted lines are sliced out of the map and decoded. A
+    batch of lines that isn't plain ASCII is decoded and split like
+    run_input does instead, so both find the same lines.
+    """
+    if os.path.getsize(input_path) == 0:
+        return 0
+    input_count = 0
+    with open(input_path, "rb") as input_file:
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = 0
+            while position < len(data):
+                batch_start = position
+                starts, ends, position = line_spans(data, position, len(data))
+                if not plain_region(data, batch_start, position):
+                    batch = text_lines(data, batch_start, position)
+                    accepted = machine.accepts_shared(batch) if trie else machine.accepts_batch(batch)
+                    machine.language.extend(compress(batch, accepted))
+                    input_count += len(batch)
+                    continue
+                if trie:
+                    accepted = machine.accepts_shared(decode_spans(data, starts, ends))
+                else:
+                    accepted = machine.accepts_spans(data, starts, ends)
+                for start, end in zip(compress(starts, accepted), compress(ends, accepted)):
+                    machine.language.append(data[start:end].decode("utf-8", "replace"))
+                input_count += len(starts)
+    return input_count
+
+
+def shard_offsets(input_path, shards):
+    """Splits the input file into at most shards byte ranges that start
+    and end on line boundaries. Returns a list of (start, end) pairs.
+    """
+    size = os.path.getsize(input_path)
+    if size == 0:
+        return []
+    with open(input_path, "rb") as input_file:
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            bounds = [0]
+            for shard in range(1, shards):
+                # Move each cut forward to just past the next newline
+                cut = data.find(b"\n", max(size * shard // shards, bounds[-1]))
+                if cut < 0:
+                    break
+                if cut + 1 < size:
+                    bounds.append(cut + 1)
+            bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+# Engine of the machine being sharded and the method to run batches
+# with, set in each worker process by init_shard so the engine is only
+# sent over once per worker
+shard_engine = None
+shard_method = "accepts_batch"
+
+def init_shard(engine, method="accepts_batch"):
+    """Sets up a worker process to run shards through the given engine
+    """
+    global shard_engine, shard_method
+    shard_engine = engine
+    shard_method = method
+
+
+def run_shard(input_path, start, end):
+    """Runs the lines in the byte range [start, end) of the input file
+    through the worker's engine. Lines are found the same way run_mapped
+    finds them, so they match the lines of a sequential run. Returns the accepted lines in order,
+    the number of lines in the range and the number of them that were
+    rejected early.
+    """
+    accepted = []
+    input_count = 0
+    rejected_early = shard_engine.rejected_early
+    with open(input_path, "rb") as input_file:
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = start
+            while position < end:
+                batch_start = position
+                starts, ends, position = line_spans(data, position, end)
+                if plain_region(data, batch_start, position):
+                    batch = decode_spans(data, starts, ends)
+                else:
+                    batch = text_lines(data, batch_start, position)
+                for input_string, accept in zip(batch, getattr(shard_engine, shard_method)(batch)):
+                    if accept:
+                        accepted.append(input_string)
+                input_count += len(batch)
+    return accepted, input_count, shard_engine.rejected_early - rejected_early
+
+
+def run_sharded(machine, input_path, shards, trie=False, stream=False):
+    """Splits the input file into line aligned shards and runs them
+    through the machine in separate worker processes. The accepted
+    lines are added to the language of the machine in input order.
+    With stream set the input is cut into pieces of about STREAM_CHUNK
+    bytes instead, so a worker never hands back more than a piece's
+    worth of accepted lines. Only about shards pieces are handed out
+    ahead of the one being added, so a slow piece holds back at most
+    that many finished ones. Returns the number of lines.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    pieces = shards
+    if stream:
+        pieces = max(shards, os.path.getsize(input_path) // STREAM_CHUNK + 1)
+    offsets = shard_offsets(input_path, pieces)
+    input_count = 0
+    with ProcessPoolExecutor(max_workers=min(shards, len(offsets)) or 1, initializer=init_shard,
+                             initargs=(machine.engine, "accepts_shared" if trie else "accepts_batch")) as executor:
+        pending = deque()
+        for start, end in offsets:
+            pending.append(executor.submit(run_shard, input_path, start, end))
+            if len(pending) > shards:
+                input_count += add_shard(machine, pending.popleft().result())
+        while pending:
+            input_count += add_shard(machine, pending.popleft().result())
+    return input_count
+
+
+def add_shard(machine, result):
+    """Adds what run_shard returned for a shard to the machine, and
+    returns the number of lines in the shard
+    """
+    accepted, count, rejected_early = result
+    machine.language.extend(accepted)
+    machine.engine.rejected_early += rejected_early
+    return count
+
+
+def chunk_mapping(engine, chunk, rows):
+    """Runs a chunk of a long string through a dense engine from each of
+    the given live rows at once, and returns a dict mapping each of them
+    to the row it ends in, or to INVALID. Rows that move to the same row
+    are merged and only run once from there, and as soon as a single row
+    is left the rest of the chunk is run the usual way. A row that
+    reaches a dead row stops there, like in CompiledMachine.run.
+    """
+    columns = engine.columns
+    table = engine.table
+    width = engine.width
+    dead = engine.dead
+    if not width:
+        # A machine with no transitions stays where it is on an empty
+        # chunk, and any character is outside of its alphabet
+        return dict((row, INVALID if chunk else row) for row in rows)
+    result = {}
+    # Maps the offset of each row still running to the rows it came from
+    groups = dict((row * width, [row]) for row in rows)
+    for index, input_char in enumerate(chunk):
+        if len(groups) == 1:
+            (offset, origins), = groups.items()
+            end = engine.run(chunk[index:], offset // width)
+            result.update(dict.fromkeys(origins, end))
+            return result
+        column = columns.get(input_char)
+        if column is None:
+            for origins in groups.values():
+                result.update(dict.fromkeys(origins, INVALID))
+            return result
+        next_groups = {}
+        for offset, origins in groups.items():
+            next_offset = table[offset + column]
+            if next_offset >= dead:
+                result.update(dict.fromkeys(origins, next_offset // width))
+            elif next_offset in next_groups:
+                next_groups[next_offset].extend(origins)
+            else:
+                next_groups[next_offset] = origins
+        groups = next_groups
+    for offset, origins in groups.items():
+        result.update(dict.fromkeys(origins, offset // width))
+    return result
+
+
+def run_chunk(input_path, start, end, first):
+    """Maps the bytes [start, end) of the input file through the worker's
+    engine with chunk_mapping, from the start row if first is set and
+    from every live row otherwise
+    """
+    with open(input_path, "rb") as input_file:
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # Latin-1 keeps one character per byte, anything that isn't
+            # ASCII is outside of the alphabet either way
+            chunk = data[start:end].decode("latin-1")
+    rows = [shard_engine.start] if first else range(shard_engine.live)
+    return chunk_mapping(shard_engine, chunk, rows)
+
+
+def run_speculative(machine, input_path, jobs):
+    """Runs the whole input file, stripped, through the machine as one
+    string and returns whether the machine accepts it. The string is
+    cut into one chunk per worker. Every chunk but the first is run
+    from every live row at once, as the row it starts in isn't known
+    yet, and the mappings from rows to rows that come back are then
+    followed in order from the start row. Only dense engines can be
+    run this way, the others are fed the chunks one after the other.
+    """
+    engine = machine.engine
+    if isinstance(engine, GeneratedMachine):
+        engine = engine.compiled
+    size = os.path.getsize(input_path)
+    start = 0
+    end = size
+    if size:
+        with open(input_path, "rb") as input_file:
+            with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                while start < end and data[start] in WHITESPACE:
+                    start += 1
+                while end > start and data[end - 1] in WHITESPACE:
+                    end -= 1
+    bounds = [start + (end - start) * x // jobs for x in range(jobs + 1)]
+    ranges = [(x, y) for x, y in zip(bounds, bounds[1:]) if y > x]
+    if not isinstance(engine, CompiledMachine):
+        cursor = Cursor(engine)
+        for chunk_start, chunk_end in ranges:
+            with open(input_path, "rb") as input_file:
+                input_file.seek(chunk_start)
+                cursor.feed(input_file.read(chunk_end - chunk_start).decode("latin-1"))
+        return cursor.accepting
+    from concurrent.futures import ProcessPoolExecutor
+    state = engine.start
+    with ProcessPoolExecutor(max_workers=len(ranges) or 1, initializer=init_shard, initargs=(engine,)) as executor:
+        mappings = executor.map(run_chunk, [input_path] * len(ranges), [x for x, y in ranges],
+                                [y for x, y in ranges], [x == 0 for x in range(len(ranges))])
+        for mapping in mappings:
+            if state == INVALID or engine.is_dead(state):
+                continue
+            state = mapping[state]
+    if state != INVALID and engine.is_dead(state):
+        engine.rejected_early += 1
+    return state != INVALID and engine.is_accept(state)
+
+
+def write_results(machine, machine_file, input_count, args):
+    """Writes the language of a machine and its log to results.
+    Returns the names of the files written.
+    """
+    outputs = ["{}.txt".format(machine_file.replace(".fa","")), "{}.log".format(machine_file.replace(".fa",""))]
+    if isinstance(machine.language, LanguageWriter):
+        # The language was written as it was accepted
+        machine.language.close()
+    else:
+        with open(os.path.join(os.path.join(os.path.dirname(__file__),"results"),"{}.txt".format(machine_file.replace(".fa",""))), "w+") as lang_file:
+            for string in machine.language:
+                lang_file.write("{}\n".format(string))
+    with open(os.path.join(os.path.join(os.path.dirname(__file__),"results"),"{}.log".format(machine_file.replace(".fa",""))), "w+") as log_file:
+        log_file.write("Valid: {}\n".format(machine.machine_type))
+        log_file.write("States: {}\n".format(len(machine.states)))
+        if args.minimize and machine.engine is not None:
+            log_file.write("Minimized States: {}\n".format(len(machine.engine.names)))
+        log_file.write("Alphabet: {}\n".format(''.join(sorted(x for x in machine.alphabet if x != '`'))))
+        log_file.write("Accepted Strings: {} / {}\n".format(len(machine.language), input_count))
+        log_file.write("Rejected Early: {}\n".format(0 if machine.engine is None else machine.engine.rejected_early))
+        if machine.stats is not None:
+            log_file.write("Parse Time: {:.6f}s\n".format(machine.parse_seconds))
+            log_file.write("Compile Time: {:.6f}s\n".format(machine.compile_seconds))
+            log_file.write("Run Time: {:.6f}s\n".format(machine.stats["run_seconds"]))
+            log_file.write("Transitions: {}\n".format(machine.stats["transitions"]))
+            log_file.write("Trap Entries: {}\n".format(machine.stats["trap_entries"]))
+            log_file.write("Alphabet Rejections: {}\n".format(machine.stats["alphabet_rejections"]))
+            # States written with leading zeros are numbered past the
+            # others, so they are shown as they were written
+            labels = dict((number, name) for name, number in machine.number_states().items())
+            log_file.write("State Visits: {}\n".format(" ".join("{}:{}".format(labels.get(state, state), count)
+                                                                for state, count in sorted(machine.stats["visits"].items()))))
+        for diagnostic in machine.diagnostics:
+            log_file.write("Diagnostic: {}\n".format(diagnostic))
+    return outputs
+
+
+def report_diagnostics(machine, machine_file):
+    """Prints the diagnostics of a machine to stderr, for the modes that
+    don't write a log
+    """
+    for diagnostic in machine.diagnostics:
+        print("{}: {}".format(machine_file, diagnostic), file=sys.stderr)
+
+
+def prepare_machine(machine_file, args):
+    """Loads a machine file and gets it ready to run. INVALID machines
+    are returned as they are, with no engine to run them.
+    """
+    machine = load_machine(os.path.join(os.path.dirname(__file__),os.path.join(os.path.join(os.path.dirname(__file__),"machine_files"), machine_file)), args)
+    if machine.machine_type == "INVALID":
+        return machine
+    if args.minimize:
+        machine.minimize()
+    return machine
+
+
+def process_machine(machine_file, args):
+    """Runs input.txt through a single machine file and writes the
+    accepted strings and a log for it to results. Every machine only
+    touches its own results, so machines can run in separate processes.
+    Returns the names of the result files written, or None if the
+    machine couldn't be processed.
+    """
+    try:
+        machine = prepare_machine(machine_file, args)
+        if machine.machine_type == "INVALID":
+            # Nothing to run, the log is still written for the
+            # diagnostics
+            return write_results(machine, machine_file, 0, args)
+        input_path = os.path.join(os.path.dirname(__file__), "input.txt")
+        if args.stream:
+            stream_language(machine, machine_file)
+        start = time.perf_counter()
+        if args.shards > 1:
+            input_count = run_sharded(machine, input_path, args.shards, args.trie, args.stream)
+        elif args.mmap:
+            input_count = run_mapped(machine, input_path, args.trie)
+        else:
+            input_count = run_input(machine, input_path, args.trie)
+        run_seconds = time.perf_counter() - start
+        if args.profile:
+            machine.stats = profile_input(machine.engine, input_path)
+            machine.stats["run_seconds"] = run_seconds
+        return write_results(machine, machine_file, input_count, args)
     except IOError as e:
-        pass
\ No newline at end of file
+        return None
+
+
+def process_one_pass(machine_files, args):
+    """Runs input.txt through every machine file in a single pass over
+    the input. Each batch of lines is read and stripped once and then
+    handed to every machine, with the dense engines advanced together
+    through a MachineStack. Returns the result files written for each
+    machine file, like process_machine.
+    """
+    written = {}
+    machines = {}
+    for machine_file in machine_files:
+        try:
+            machine = prepare_machine(machine_file, args)
+            if machine.machine_type == "INVALID":
+                written[machine_file] = write_results(machine, machine_file, 0, args)
+            else:
+                machines[machine_file] = machine
+        except IOError as e:
+            written[machine_file] = None
+    stacked = [x for x in sorted(machines) if isinstance(machines[x].engine, CompiledMachine)]
+    others = [x for x in sorted(machines) if x not in stacked]
+    stack = MachineStack([machines[x].engine for x in stacked])
+    input_count = 0
+    try:
+        if args.stream:
+            for machine_file in machines:
+                stream_language(machines[machine_file], machine_file)
+        with open(os.path.join(os.path.dirname(__file__), "input.txt"), "r") as input_file:
+            while True:
+                batch = [input_string.strip() for input_string in islice(input_file, BATCH_SIZE)]
+                if not batch:
+                    break
+                results = stack.accepts_batch(batch)
+                results.extend(machines[x].accepts_batch(batch) for x in others)
+                for machine_file, accepted in zip(stacked + others, results):
+                    language = machines[machine_file].language
+                    for input_string, accept in zip(batch, accepted):
+                        if accept:
+                            language.append(input_string)
+                input_count += len(batch)
+        for machine_file in machines:
+            written[machine_file] = write_results(machines[machine_file], machine_file, input_count, args)
+    except IOError as e:
+        for machine_file in machines:
+            written[machine_file] = None
+    return [written[x] for x in machine_files]
+
+
+class MachineStack():
+    def __init__(self, engines):
+        """Initialize a stack of dense engines that are run together.
+        The tables of every engine are stacked into one table over the
+        union of their alphabets, with one extra row per engine that
+        characters outside of that engine's alphabet lead to and never
+        leave. A string then has one state per engine, and one gather
+        over the stacked table advances every engine at once.
+        Without NumPy each engine simply runs the batch on its own.
+        """
+        self.engines = engines
+        if load_numpy() is None:
+            return
+        chars_used = sorted(set(char for engine in engines for char in engine.columns))
+        union = dict((char, column) for column, char in enumerate(chars_used))
+        # The last column is for characters in none of the alphabets
+        self.byte_columns = numpy.full(256, len(union), dtype=numpy.intp)
+        for char, column in union.items():
+            self.byte_columns[ord(char)] = column
+        total = sum(len(engine.names) + 1 for engine in engines)
+        self.table = numpy.zeros((total, len(union) + 1), dtype=numpy.intp)
+        self.accept = numpy.zeros(total, dtype=bool)
+        # The sink rows aren't counted as dead, a string only gets there
+        # by holding a character outside of the alphabet
+        self.dead = numpy.zeros(total, dtype=bool)
+        self.starts = []
+        base = 0
+        for engine in engines:
+            rows = len(engine.names)
+            sink = base + rows
+            width = engine.width
+            self.table[base:sink + 1] = sink
+            if width:
+                table = numpy.array(engine.table, dtype=numpy.intp).reshape(rows, width) // width + base
+                for char, column in engine.columns.items():
+                    self.table[base:sink, union[char]] = table[:, column]
+            self.accept[base:sink] = numpy.frombuffer(bytes(engine.accept), dtype=numpy.uint8)
+            self.dead[base + engine.live:sink] = True
+            self.starts.append(base + engine.start)
+            base = sink + 1
+
+    def accepts_batch(self, strings):
+        """Runs a list of strings through every engine in the stack.
+        Returns one list of booleans per engine.
+        """
+        if numpy is None or not self.engines:
+            return [engine.accepts_batch(strings) for engine in self.engines]
+        index, data, offsets, active = pack_batch(strings, self.byte_columns)
+        # Strings with non ASCII characters are left out of the batch,
+        # run them on their own so they are counted the same way
+        packed = set(index.tolist())
+        for i, input_string in enumerate(strings):
+            if i not in packed:
+                for engine in self.engines:
+                    engine.run(input_string)
+        states = numpy.tile(numpy.array(self.starts, dtype=numpy.intp), (len(index), 1))
+        reached = self.dead[states]
+        for j, count in enumerate(active):
+            states[:count] = self.table[states[:count], data[offsets[:count] + j][:, None]]
+            reached[:count] |= self.dead[states[:count]]
+        for engine, rejected_early in zip(self.engines, reached.sum(axis=0).tolist()):
+            engine.rejected_early += rejected_early
+        accepted = numpy.zeros((len(strings), len(self.engines)), dtype=bool)
+        accepted[index] = self.accept[states]
+        return accepted.T.tolist()
+
+
+def main(argv=None):
+    """Runs every machine in machine_files against input.txt and writes
+    the accepted strings and a log for each machine to results.
+    """
+    parser = argparse.ArgumentParser(description="Run the machines in machine_files against input.txt")
+    parser.add_argument("--minimize", action="store_true",
+                        help="minimize each DFA before running the input through it")
+    parser.add_argument("--engine", choices=ENGINES, default="auto",
+                        help="how to run NFAs: by subset construction (dense), by bitset simulation, "
+                             "by a lazily built DFA, or auto")
+    parser.add_argument("--lazy-cache", type=int, default=LAZY_CACHE_SIZE,
+                        help="most DFA states the lazy engine keeps cached")
+    parser.add_argument("--cache", default=None,
+                        help="directory to keep compiled machines in between runs")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes to spread the machines across")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="number of worker processes to split input.txt across for each machine")
+    parser.add_argument("--one-pass", action="store_true",
+                        help="read input.txt once and run every machine on it together")
+    parser.add_argument("--trie", action="store_true",
+                        help="run the input in sorted order so shared prefixes are only run once")
+    parser.add_argument("--force", action="store_true",
+                        help="rerun every machine, even if its results are up to date")
+    parser.add_argument("--profile", action="store_true",
+                        help="add timings, transition counts and state visits to each log")
+    parser.add_argument("--mmap", action="store_true",
+                        help="map input.txt into memory and run the lines straight out of it")
+    parser.add_argument("--stream", action="store_true",
+                        help="write accepted strings out as they are found instead of keeping them in memory")
+    parser.add_argument("--max-state", type=int, default=MAX_STATE,
+                        help="largest state a machine file may use, -1 for no limit")
+    parser.add_argument("--trap-state", type=int, default=TRAP_STATE,
+                        help="state a DFA falls into when it has no transition for a character")
+    parser.add_argument("--speculate", default=None, metavar="PATH",
+                        help="instead of running input.txt, run the whole file at PATH as one string through each "
+                             "machine, split across --jobs worker processes")
+    parser.add_argument("--scan", default=None, metavar="PATH",
+                        help="instead of running input.txt, print every match of each machine in the file at PATH")
+    args = parser.parse_args(argv)
+    if args.max_state < 0:
+        args.max_state = None
+    if args.trap_state < 0:
+        parser.error("--trap-state can't be negative")
+    if args.jobs > 1 and args.shards > 1:
+        parser.error("--jobs and --shards can't be used together")
+    if args.one_pass and (args.jobs > 1 or args.shards > 1 or args.trie or args.profile or args.mmap):
+        parser.error("--one-pass can't be used with --jobs, --shards, --trie, --profile or --mmap")
+
+    if args.speculate is not None:
+        for machine_file in sorted(os.listdir(os.path.join(os.path.dirname(__file__),"machine_files"))):
+            machine = prepare_machine(machine_file, args)
+            if machine.machine_type == "INVALID":
+                report_diagnostics(machine, machine_file)
+                continue
+            accepted = run_speculative(machine, args.speculate, max(args.jobs, 1))
+            print("{}: {}".format(machine_file, "accepted" if accepted else "rejected"))
+        return
+
+    if args.scan is not None:
+        # Print the matches grep style, as machine:offset:text
+        for machine_file in sorted(os.listdir(os.path.join(os.path.dirname(__file__),"machine_files"))):
+            machine = prepare_machine(machine_file, args)
+            if machine.machine_type == "INVALID":
+                report_diagnostics(machine, machine_file)
+                continue
+            for start, end, text in scan_file(machine, args.scan):
+                print("{}:{}:{}".format(machine_file, start, text))
+        return
+
+    if not os.path.exists(os.path.join(os.path.dirname(__file__),"results")):
+        os.makedirs(os.path.join(os.path.dirname(__file__),"results"))
+
+    # Only rerun the machines whose machine file, input or options
+    # changed since the manifest was written, or whose results are gone
+    manifest_path = os.path.join(os.path.join(os.path.dirname(__file__),"results"), MANIFEST)
+    manifest = read_manifest(manifest_path)
+    input_digest = file_digest(os.path.join(os.path.dirname(__file__), "input.txt"))
+    options = "engine={} lazy_cache={} minimize={} profile={} max_state={} trap_state={}".format(
+        args.engine, args.lazy_cache, args.minimize, args.profile, args.max_state, args.trap_state)
+    machine_files = sorted(os.listdir(os.path.join(os.path.dirname(__file__),"machine_files")))
+    keys = {}
+    pending = []
+    for machine_file in machine_files:
+        keys[machine_file] = {
+            "machine": file_digest(os.path.join(os.path.join(os.path.dirname(__file__),"machine_files"), machine_file)),
+            "input": input_digest,
+            "engine_version": ENGINE_VERSION,
+            "options": options,
+        }
+        entry = manifest.get(machine_file)
+        if (not args.force and entry is not None and entry["key"] == keys[machine_file]
+                and all(os.path.exists(os.path.join(os.path.join(os.path.dirname(__file__),"results"), x))
+                        for x in entry["outputs"])):
+            continue
+        pending.append(machine_file)
+
+    if args.one_pass:
+        written = process_one_pass(pending, args)
+    elif args.jobs > 1:
+        # Each worker parses, runs and writes out its own machines, the
+        # results only depend on the machine file so the order the
+        # workers finish in doesn't matter
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            written = list(executor.map(process_machine, pending, [args] * len(pending)))
+    else:
+        written = [process_machine(machine_file, args) for machine_file in pending]
+
+    for machine_file, outputs in zip(pending, written):
+        if outputs is None or keys[machine_file]["machine"] is None:
+            manifest.pop(machine_file, None)
+        else:
+            manifest[machine_file] = {"key": keys[machine_file], "outputs": outputs}
+    for machine_file in list(manifest):
+        if machine_file not in keys:
+            del manifest[machine_file]
+    write_manifest(manifest_path, manifest)
+
+if __name__ == "__main__":
+    main()
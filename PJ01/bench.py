@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import subprocess
+import tempfile
+import time
+import FSM
+
+# Characters the generated machines and inputs are drawn from, every
+# printable character but the ` used for epsilon transitions and the ,
+# that separates the fields of a transition
+ALPHABET = [x for x in FSM.chars if x not in ",`"]
+# Ways the lengths of the generated input strings can be spread
+LENGTH_DISTRIBUTIONS = ["fixed", "uniform", "geometric"]
+# Ways the engines are handed the input
+METHODS = ["accepts", "accepts_batch", "accepts_shared"]
+
+
+def random_dfa(rand, states, alphabet, density, accept_ratio):
+    """Returns the text of a machine file for a random DFA over the
+    given characters. Each state has a transition on each character
+    with probability density, every other pair falls into the trap
+    state, and each state is an accept state with probability
+    accept_ratio.
+    """
+    accept = [str(x) for x in range(states) if rand.random() < accept_ratio]
+    lines = ["{{{}}}".format(",".join(accept))]
+    for from_state in range(states):
+        for char in alphabet:
+            if rand.random() < density:
+                lines.append("{},{},{}".format(from_state, char, rand.randrange(states)))
+    return "\n".join(lines) + "\n"
+
+
+def random_nfa(rand, states, alphabet, density, accept_ratio, fanout, epsilon):
+    """Returns the text of a machine file for a random NFA over the
+    given characters. Each state has transitions on each character
+    with probability density, to between one and fanout states, and
+    an epsilon transition to a random state with probability epsilon.
+    """
+    accept = [str(x) for x in range(states) if rand.random() < accept_ratio]
+    lines = ["{{{}}}".format(",".join(accept))]
+    for from_state in range(states):
+        for char in alphabet:
+            if rand.random() < density:
+                for to_state in rand.sample(range(states), rand.randint(1, min(fanout, states))):
+                    lines.append("{},{},{}".format(from_state, char, to_state))
+        if rand.random() < epsilon:
+            lines.append("{},`,{}".format(from_state, rand.randrange(states)))
+    return "\n".join(lines) + "\n"
+
+
+def random_strings(rand, count, alphabet, length, distribution):
+    """Returns count random strings over the given characters. With the
+    fixed distribution every string is length characters long, with
+    uniform the lengths are spread evenly between 0 and twice length,
+    and with geometric short strings are the most common but the mean
+    length is still length.
+    """
+    strings = []
+    for _ in range(count):
+        if distribution == "fixed":
+            size = length
+        elif distribution == "uniform":
+            size = rand.randint(0, 2 * length)
+        else:
+            size = int(rand.expovariate(1.0 / length)) if length else 0
+        strings.append("".join(rand.choice(alphabet) for _ in range(size)))
+    return strings
+
+
+def git_commit():
+    """Returns the commit the benchmark is run on, or None outside of a
+    git checkout
+    """
+    try:
+        output = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip()
+
+
+def best_time(function, repeat):
+    """Calls function repeat times and returns the fastest time taken
+    along with the result of the last call
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        taken = time.perf_counter() - start
+        if best is None or taken < best:
+            best = taken
+    return best, result
+
+
+def bench_machine(name, machine_path, strings, engines, args):
+    """Times parsing the machine file, building each engine and running
+    the strings through it with each method. Returns a list of
+    results, one per engine.
+    """
+    parse_seconds, machine = best_time(lambda: FSM.Machine(machine_path, None, max_state=None), args.repeat)
+    results = []
+    for engine in engines:
+        # Build each engine from a fresh parse, engines like the lazy
+        # one keep state between runs
+        machine = FSM.Machine(machine_path, None, max_state=None)
+        if engine == "dense" and machine.machine_type == "NFA" and machine.determinize(FSM.SUBSET_LIMIT) is None:
+            # The full subset construction can take exponential time,
+            # leave it out rather than never finishing
+            results.append({"machine": name, "engine": engine, "type": machine.machine_type,
+                            "skipped": "more than {} DFA states".format(FSM.SUBSET_LIMIT)})
+            continue
+        compile_seconds, _ = best_time(lambda: machine.build_engine(engine, args.lazy_cache), args.repeat)
+        if args.minimize:
+            machine.minimize()
+        result = {
+            "machine": name,
+            "engine": engine,
+            "type": machine.machine_type,
+            "engine_class": type(machine.engine).__name__,
+            "states": len(machine.states),
+            "engine_states": len(machine.engine.names),
+            "parse_seconds": parse_seconds,
+            "compile_seconds": compile_seconds,
+            "methods": {},
+        }
+        runs = {
+            "accepts": lambda: [machine.engine.accepts(x) for x in strings],
+            "accepts_batch": lambda: machine.accepts_batch(strings),
+            "accepts_shared": lambda: machine.accepts_shared(strings),
+        }
+        accepted = None
+        for method in METHODS:
+            seconds, answers = best_time(runs[method], args.repeat)
+            # Every method has to agree, a fast wrong answer is no use
+            if accepted is None:
+                accepted = answers
+            elif answers != accepted:
+                raise RuntimeError("{} gave different answers with {} on {}".format(method, engine, name))
+            result["methods"][method] = {
+                "seconds": seconds,
+                "strings_per_second": len(strings) / seconds if seconds else None,
+            }
+        result["accepted"] = sum(accepted)
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    """Generates a random DFA, a random NFA and an input corpus, and
+    prints or writes the time taken by each engine as JSON
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the FSM engines on random machines and input")
+    parser.add_argument("--states", type=int, default=200,
+                        help="number of states in the generated machines")
+    parser.add_argument("--alphabet", type=int, default=26,
+                        help="number of characters in the generated machines")
+    parser.add_argument("--density", type=float, default=0.9,
+                        help="probability that a state has a transition on a character")
+    parser.add_argument("--accept-ratio", type=float, default=0.2,
+                        help="probability that a state is an accept state")
+    parser.add_argument("--nfa-states", type=int, default=40,
+                        help="number of states in the generated NFA, 0 to leave it out")
+    parser.add_argument("--fanout", type=int, default=2,
+                        help="most states an NFA transition leads to")
+    parser.add_argument("--epsilon", type=float, default=0.1,
+                        help="probability that an NFA state has an epsilon transition")
+    parser.add_argument("--strings", type=int, default=20000,
+                        help="number of input strings")
+    parser.add_argument("--length", type=int, default=20,
+                        help="mean length of the input strings")
+    parser.add_argument("--distribution", choices=LENGTH_DISTRIBUTIONS, default="geometric",
+                        help="how the lengths of the input strings are spread")
+    parser.add_argument("--engines", nargs="+", choices=FSM.ENGINES, default=FSM.ENGINES,
+                        help="engines to time")
+    parser.add_argument("--lazy-cache", type=int, default=FSM.LAZY_CACHE_SIZE,
+                        help="most DFA states the lazy engine keeps cached")
+    parser.add_argument("--minimize", action="store_true",
+                        help="minimize each engine before running the input through it")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of times each step is timed, the fastest time is kept")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed for the random machines and input")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON results to instead of printing them")
+    args = parser.parse_args(argv)
+    if args.states < 1 or args.nfa_states < 0:
+        parser.error("--states must be at least 1 and --nfa-states can't be negative")
+    if not 0 < args.alphabet <= len(ALPHABET):
+        parser.error("--alphabet must be between 1 and {}".format(len(ALPHABET)))
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    rand = random.Random(args.seed)
+    alphabet = ALPHABET[:args.alphabet]
+    machines = [("dfa", random_dfa(rand, args.states, alphabet, args.density, args.accept_ratio))]
+    if args.nfa_states:
+        machines.append(("nfa", random_nfa(rand, args.nfa_states, alphabet, args.density, args.accept_ratio,
+                                           args.fanout, args.epsilon)))
+    strings = random_strings(rand, args.strings, alphabet, args.length, args.distribution)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, text in machines:
+            machine_path = os.path.join(directory, "{}.fa".format(name))
+            with open(machine_path, "w") as machine_file:
+                machine_file.write(text)
+            results.extend(bench_machine(name, machine_path, strings, args.engines, args))
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": FSM.load_numpy().__version__ if FSM.load_numpy() is not None else None,
+        "config": vars(args),
+        "input_characters": sum(len(x) for x in strings),
+        "results": results,
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+if __name__ == "__main__":
+    main()
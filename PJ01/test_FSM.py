@@ -0,0 +1,454 @@
+import argparse
+import importlib.util
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import FSM
+import bench
+
+
+def write_machine(text):
+    """Writes the text of a machine file to a temporary file and returns
+    its path
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".fa", delete=False) as machine_file:
+        machine_file.write(text)
+    return machine_file.name
+
+
+def has_numpy():
+    """Returns True if NumPy can be imported
+    """
+    saved = FSM.numpy, FSM.numpy_loaded
+    FSM.numpy_loaded = False
+    try:
+        return FSM.load_numpy() is not None
+    finally:
+        FSM.numpy, FSM.numpy_loaded = saved
+
+
+class numpy_state():
+    def __init__(self, enabled):
+        """Initialize a context that runs FSM with NumPy if enabled and
+        NumPy is installed, and as if it weren't installed otherwise
+        """
+        self.enabled = enabled
+
+    def __enter__(self):
+        self.saved = FSM.numpy, FSM.numpy_loaded
+        FSM.numpy_loaded = False
+        if self.enabled:
+            FSM.load_numpy()
+        else:
+            FSM.numpy = None
+            FSM.numpy_loaded = True
+
+    def __exit__(self, *exc_info):
+        FSM.numpy, FSM.numpy_loaded = self.saved
+
+
+class StateNameTest(unittest.TestCase):
+    def test_states_match_as_written(self):
+        """States and accept states are matched as they are written, so
+        01 is a state of its own and " 1" never accepts
+        """
+        cases = [("{0,1}\n0,a,1\n", ["a"], []),
+                 ("{0, 1}\n0,a,1\n", [], ["a"]),
+                 ("{01}\n0,a,1\n", [], ["a"]),
+                 ("{01}\n0,a,01\n", ["a"], []),
+                 ("{1}\n0,a,01\n01,b,1\n0,c,1\n", ["ab", "c"], ["a", "cb"]),
+                 ("{1}\n0,a,01\n01,b,1\n0,a,1\n", ["ab", "a"], ["aa"])]
+        for text, accepted, rejected in cases:
+            path = write_machine(text)
+            try:
+                for engine in FSM.ENGINES:
+                    machine = FSM.Machine(path, engine)
+                    self.assertNotEqual(machine.machine_type, "INVALID")
+                    self.assertEqual([machine.engine.accepts(x) for x in accepted], [True] * len(accepted))
+                    self.assertEqual([machine.engine.accepts(x) for x in rejected], [False] * len(rejected))
+            finally:
+                os.unlink(path)
+
+
+class GeneratedMachineTest(unittest.TestCase):
+    def test_matches_dense(self):
+        """Generated code runs every string from every row to the same row
+        as the table it was generated from, however many rows it has
+        """
+        rand = random.Random(3)
+        for trial in range(20):
+            alphabet = bench.ALPHABET[:rand.randint(1, 6)]
+            path = write_machine(bench.random_dfa(rand, rand.randint(1, 60), alphabet, 0.8, 0.3))
+            try:
+                dense = FSM.Machine(path, "dense").engine
+                generated = FSM.GeneratedMachine(dense)
+                strings = bench.random_strings(rand, 100, bench.ALPHABET[:7], 10, "uniform")
+                self.assertEqual(generated.accepts_batch(strings), [dense.accepts(x) for x in strings])
+                for row in range(len(dense.names)):
+                    self.assertEqual([generated.run(x, row) for x in strings], [dense.run(x, row) for x in strings])
+            finally:
+                os.unlink(path)
+
+
+class LazyCacheTest(unittest.TestCase):
+    def test_tiny_cache_matches_bitset(self):
+        """The lazy engine flushes its cache all the time with a tiny cache,
+        which mustn't change what it accepts
+        """
+        rand = random.Random(6)
+        alphabet = bench.ALPHABET[:3]
+        for trial in range(60):
+            path = write_machine(bench.random_nfa(rand, rand.randint(2, 10), alphabet, 0.7, 0.3, 3, 0.2))
+            try:
+                bitset = FSM.Machine(path, "bitset").engine
+                strings = bench.random_strings(rand, 40, alphabet, 8, "uniform")
+                expected = [bitset.accepts(x) for x in strings]
+                for cache_size in (2, 3, 8):
+                    lazy = FSM.Machine(path, "lazy", lazy_cache=cache_size).engine
+                    self.assertEqual([lazy.accepts(x) for x in strings], expected)
+            finally:
+                os.unlink(path)
+
+
+class ScannerTest(unittest.TestCase):
+    def brute_force_matches(self, engine, line):
+        """Returns the leftmost longest matches of a line found by trying
+        every substring
+        """
+        matches = []
+        position = 0
+        while position < len(line):
+            match = None
+            for start in range(position, len(line)):
+                for end in range(len(line), start, -1):
+                    if engine.accepts(line[start:end]):
+                        match = (start, end)
+                        break
+                if match:
+                    break
+            if not match:
+                break
+            matches.append(match)
+            position = match[1]
+        return matches
+
+    def test_matches_brute_force(self):
+        """Every engine finds the same matches as trying every substring,
+        with a cache small enough to be emptied along the way
+        """
+        rand = random.Random(4)
+        for trial in range(60):
+            alphabet = bench.ALPHABET[:rand.randint(1, 4)]
+            if trial % 2:
+                text = bench.random_dfa(rand, rand.randint(1, 8), alphabet, rand.random(), 0.3)
+            else:
+                text = bench.random_nfa(rand, rand.randint(1, 6), alphabet, rand.random(), 0.3, 2, 0.2)
+            lines = bench.random_strings(rand, 30, bench.ALPHABET[:6], 8, "uniform")
+            path = write_machine(text)
+            try:
+                for engine in FSM.ENGINES:
+                    machine = FSM.Machine(path, engine)
+                    scanner = FSM.Scanner(machine.engine, cache_size=3)
+                    for line in lines:
+                        self.assertEqual(list(scanner.matches(line)), self.brute_force_matches(machine.engine, line))
+            finally:
+                os.unlink(path)
+
+
+    def test_reads_each_character_once(self):
+        """A line of a's under a|aa*b|ab holds a match at every position,
+        and every start can be extended until the end of the line. Each
+        character is still only run once per state it can be in.
+        """
+        path = write_machine("{1,3}\n0,a,1\n1,a,2\n2,a,2\n2,b,3\n1,b,3\n")
+        try:
+            engine = FSM.Machine(path, "dense").engine
+        finally:
+            os.unlink(path)
+        calls = [0]
+        run = engine.run
+
+        def counted_run(input_string, row=0):
+            calls[0] += 1
+            return run(input_string, row)
+
+        engine.run = counted_run
+        line = "a" * 5000
+        self.assertEqual(list(FSM.Scanner(engine).matches(line)), [(x, x + 1) for x in range(len(line))])
+        self.assertLessEqual(calls[0], len(engine.names) * len(line))
+
+
+class SpansTest(unittest.TestCase):
+    def test_matches_accepts(self):
+        """Running the lines of a buffer in place gives the same answers
+        as running each line on its own, for machines with and without
+        columns
+        """
+        rand = random.Random(8)
+        texts = ["{0}\n", "{0}\n0,`,0\n", "{}\n"]
+        texts.extend(bench.random_dfa(rand, rand.randint(1, 8), bench.ALPHABET[:3], 0.8, 0.4) for _ in range(10))
+        for text in texts:
+            strings = bench.random_strings(rand, 30, bench.ALPHABET[:4], 4, "uniform") + [""]
+            buffer = "\n".join(strings).encode()
+            starts = []
+            ends = []
+            position = 0
+            for string in strings:
+                starts.append(position)
+                ends.append(position + len(string))
+                position += len(string) + 1
+            path = write_machine(text)
+            try:
+                for engine in FSM.ENGINES:
+                    machine = FSM.Machine(path, engine)
+                    self.assertEqual(machine.accepts_spans(buffer, starts, ends),
+                                     [machine.engine.accepts(x) for x in strings])
+            finally:
+                os.unlink(path)
+
+
+# Lines that only split and strip the way text mode does if carriage
+# returns end lines and non ASCII whitespace is stripped
+AWKWARD_LINES = b"ba\xc2\xa0\nba\r\n\xe3\x80\x80ba\nba\rab\n\r\rab\n \t0 1\n"
+
+
+def write_input(machine, rand):
+    """Writes random lines over the alphabet of a machine, and the awkward
+    lines, to a temporary file and returns its path
+    """
+    strings = bench.random_strings(rand, 200, sorted(machine.engine.columns) or ["a"], 4, "uniform")
+    with tempfile.NamedTemporaryFile("wb", suffix=".txt", delete=False) as input_file:
+        input_file.write("\n".join(strings).encode() + b"\n" + AWKWARD_LINES + b"ab\r")
+    return input_file.name
+
+
+class MappedTest(unittest.TestCase):
+    def test_matches_run_input(self):
+        """Running the lines straight out of a map finds the same lines,
+        and accepts the same ones, as reading the file in text mode, with
+        and without NumPy
+        """
+        rand = random.Random(9)
+        paths = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "machine_files", x)
+                 for x in sorted(os.listdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), "machine_files")))]
+        for path in paths:
+            input_path = write_input(FSM.Machine(path), rand)
+            try:
+                for with_numpy in ([False, True] if has_numpy() else [False]):
+                    with numpy_state(with_numpy):
+                        for trie in (False, True):
+                            expected = FSM.Machine(path)
+                            expected_count = FSM.run_input(expected, input_path, trie)
+                            mapped = FSM.Machine(path)
+                            self.assertEqual(FSM.run_mapped(mapped, input_path, trie), expected_count)
+                            self.assertEqual(mapped.language, expected.language)
+            finally:
+                os.unlink(input_path)
+
+
+class ShardTest(unittest.TestCase):
+    def test_matches_run_input(self):
+        """Splitting the input across workers finds and accepts the same
+        lines, in the same order, as a sequential run
+        """
+        rand = random.Random(10)
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "machine_files", "m00.fa")
+        input_path = write_input(FSM.Machine(path), rand)
+        try:
+            for trie in (False, True):
+                expected = FSM.Machine(path)
+                expected_count = FSM.run_input(expected, input_path, trie)
+                for shards in (2, 5):
+                    sharded = FSM.Machine(path)
+                    self.assertEqual(FSM.run_sharded(sharded, input_path, shards, trie), expected_count)
+                    self.assertEqual(sharded.language, expected.language)
+        finally:
+            os.unlink(input_path)
+
+
+class SpeculativeTest(unittest.TestCase):
+    def test_matches_sequential_run(self):
+        """Running a file as one string split across workers accepts it
+        exactly when running it in one go does
+        """
+        rand = random.Random(6)
+        for trial in range(10):
+            alphabet = bench.ALPHABET[:rand.randint(1, 3)]
+            if trial % 3:
+                text = bench.random_dfa(rand, rand.randint(1, 8), alphabet, 0.95, 0.4)
+            else:
+                text = bench.random_nfa(rand, rand.randint(1, 6), alphabet, 0.9, 0.3, 2, 0.2)
+            string = "".join(rand.choice(bench.ALPHABET[:3]) for _ in range(rand.randint(0, 300)))
+            self.check_machine(text, string)
+
+    def test_machine_without_transitions(self):
+        """A machine with no columns accepts the empty string only
+        """
+        for text in ("{0}\n", "{0}\n0,`,0\n"):
+            for string in ("", "a"):
+                self.check_machine(text, string)
+
+    def check_machine(self, text, string):
+        """Runs a string written to a file through every engine, both
+        speculatively and in one go, and checks that they agree
+        """
+        path = write_machine(text)
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as input_file:
+            input_file.write(" {}\n".format(string))
+        try:
+            for engine in FSM.ENGINES:
+                machine = FSM.Machine(path, engine)
+                expected = machine.engine.accepts(string)
+                for jobs in (1, 3):
+                    self.assertEqual(FSM.run_speculative(machine, input_file.name, jobs), expected)
+        finally:
+            os.unlink(path)
+            os.unlink(input_file.name)
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        """Copies FSM.py, two machine files and input.txt to a temporary
+        folder and imports that copy, so its results land there
+        """
+        here = os.path.dirname(os.path.abspath(__file__))
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, "machine_files"))
+        for machine_file in ("m00.fa", "m03.fa"):
+            shutil.copy(os.path.join(here, "machine_files", machine_file),
+                        os.path.join(self.folder, "machine_files", machine_file))
+        shutil.copy(os.path.join(here, "input.txt"), os.path.join(self.folder, "input.txt"))
+        shutil.copy(os.path.join(here, "FSM.py"), os.path.join(self.folder, "FSM.py"))
+        spec = importlib.util.spec_from_file_location("copied_FSM", os.path.join(self.folder, "FSM.py"))
+        self.fsm = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.fsm)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def rerun(self, argv=()):
+        """Runs the copy after marking every result file as stale, and
+        returns the machine files whose results were written again
+        """
+        results = os.path.join(self.folder, "results")
+        for result_file in os.listdir(results):
+            if result_file != self.fsm.MANIFEST:
+                with open(os.path.join(results, result_file), "w") as stale_file:
+                    stale_file.write("stale")
+        self.fsm.main(list(argv))
+        rerun = set()
+        for result_file in os.listdir(results):
+            with open(os.path.join(results, result_file)) as written:
+                if written.read() != "stale" and result_file != self.fsm.MANIFEST:
+                    rerun.add(os.path.splitext(result_file)[0] + ".fa")
+        return rerun
+
+    def test_reruns_what_changed(self):
+        """Only the machines whose machine file, input, options or results
+        changed since the last run are run again
+        """
+        self.fsm.main([])
+        self.assertEqual(self.rerun(), set())
+        with open(os.path.join(self.folder, "machine_files", "m03.fa"), "a") as machine_file:
+            machine_file.write("\n")
+        self.assertEqual(self.rerun(), set(["m03.fa"]))
+        self.assertEqual(self.rerun(), set())
+        with open(os.path.join(self.folder, "input.txt"), "a") as input_file:
+            input_file.write("a\n")
+        self.assertEqual(self.rerun(), set(["m00.fa", "m03.fa"]))
+        self.assertEqual(self.rerun(["--engine", "bitset"]), set(["m00.fa", "m03.fa"]))
+        self.assertEqual(self.rerun(["--engine", "bitset"]), set())
+        os.unlink(os.path.join(self.folder, "results", "m00.txt"))
+        self.assertEqual(self.rerun(["--engine", "bitset"]), set(["m00.fa"]))
+        self.assertEqual(self.rerun(["--engine", "bitset", "--force"]), set(["m00.fa", "m03.fa"]))
+
+
+class CacheTest(unittest.TestCase):
+    def test_round_trip(self):
+        """A machine loaded back from the cache reads and accepts the same
+        as the machine it was saved from, for every engine
+        """
+        rand = random.Random(11)
+        folder = tempfile.mkdtemp()
+        texts = [bench.random_dfa(rand, 6, bench.ALPHABET[:3], 0.9, 0.3),
+                 bench.random_nfa(rand, 5, bench.ALPHABET[:3], 0.8, 0.3, 2, 0.2), "{0,1}\n0,a,300\n"]
+        strings = bench.random_strings(rand, 100, bench.ALPHABET[:4], 8, "uniform")
+        try:
+            for text in texts:
+                path = write_machine(text)
+                try:
+                    for engine in FSM.ENGINES:
+                        args = argparse.Namespace(cache=folder, engine=engine, lazy_cache=FSM.LAZY_CACHE_SIZE,
+                                                  max_state=FSM.MAX_STATE, trap_state=FSM.TRAP_STATE)
+                        machine = FSM.load_machine(path, args)
+                        cached = FSM.load_machine(path, args)
+                        self.assertEqual(cached.compile_seconds, 0.0)
+                        self.assertEqual((cached.machine_type, cached.states, cached.accept, cached.diagnostics),
+                                         (machine.machine_type, machine.states, machine.accept, machine.diagnostics))
+                        self.assertEqual(type(cached.engine), type(machine.engine))
+                        if machine.engine is not None:
+                            self.assertEqual(cached.accepts_batch(strings), machine.accepts_batch(strings))
+                finally:
+                    os.unlink(path)
+            self.assertTrue(any(x.endswith(".py") for x in os.listdir(folder)))
+        finally:
+            shutil.rmtree(folder)
+
+
+class VectorizedTest(unittest.TestCase):
+    def setUp(self):
+        """Builds dense engines for random DFAs and NFAs, and machines
+        without transitions, along with strings to run through them and
+        what each engine makes of them one string at a time
+        """
+        rand = random.Random(12)
+        texts = ["{0}\n", "{}\n"]
+        for trial in range(12):
+            alphabet = bench.ALPHABET[:rand.randint(1, 4)]
+            if trial % 3:
+                texts.append(bench.random_dfa(rand, rand.randint(1, 10), alphabet, 0.8, 0.3))
+            else:
+                texts.append(bench.random_nfa(rand, rand.randint(1, 6), alphabet, 0.8, 0.3, 2, 0.2))
+        self.engines = []
+        for text in texts:
+            path = write_machine(text)
+            try:
+                self.engines.append(FSM.Machine(path, "dense").engine)
+            finally:
+                os.unlink(path)
+        self.strings = bench.random_strings(rand, 300, bench.ALPHABET[:5], 10, "uniform") + ["", "ab\u00e9", "\u00e9"]
+        self.expected = []
+        self.expected_early = []
+        for engine in self.engines:
+            engine.rejected_early = 0
+            self.expected.append([engine.accepts(x) for x in self.strings])
+            self.expected_early.append(engine.rejected_early)
+            engine.rejected_early = 0
+
+    @unittest.skipIf(not has_numpy(), "NumPy is not installed")
+    def test_engine_matches_accepts(self):
+        """The NumPy batch run of an engine accepts the same strings, and
+        gives up on as many, as running each string on its own
+        """
+        with numpy_state(True):
+            for engine, accepted, rejected_early in zip(self.engines, self.expected, self.expected_early):
+                self.assertEqual(engine.accepts_batch(self.strings), accepted)
+                self.assertEqual(engine.rejected_early, rejected_early)
+
+
+    @unittest.skipIf(not has_numpy(), "NumPy is not installed")
+    def test_stack_matches_accepts(self):
+        """Running a batch through a stack of engines accepts the same
+        strings, and gives up on as many, as running each string through
+        each engine on its own
+        """
+        with numpy_state(True):
+            stack = FSM.MachineStack(self.engines)
+            self.assertEqual(stack.accepts_batch(self.strings), self.expected)
+            self.assertEqual([engine.rejected_early for engine in self.engines], self.expected_early)
+
+
+if __name__ == "__main__":
+    unittest.main()
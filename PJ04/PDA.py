@@ -1,17 +1,39 @@
 import re
 import os
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import time
 chars=[' ',"`","!","\"","#","$","%","&","'","(",")","*","+",",","-",".","/","0","1","2","3","4","5","6","7","8","9",":",";","<","=",">","?","@","A","B","C","D","E","F","G","H","I","J","K","L","M","N","O","P","Q","R","S","T","U","V","W","X","Y","Z","[","\\","]","^","_","a","b","c","d","e","f","g","h","i","j","k","l","m","n","o","p","q","r","s","t","u","v","w","x","y","z","{","|","}","~"]
 line_regex = re.compile(r"(\d+),(.*),(.*),(\d+),(.*)")
+# Bumped whenever the way machines are run changes, so results
+# computed by an older version are recomputed
+ENGINE_VERSION = 2
+# Name of the file in results that records what each result was
+# computed from
+MANIFEST = "manifest.json"
+# State a PDA falls into when it has no transition to take
+TRAP_STATE = 255
+# Largest state number a machine file may use by default. Machines
+# with bigger states are INVALID unless the limit is raised
+MAX_STATE = 255
 
 class DPDA():
-    def __init__(self, machine_file):
+    def __init__(self, machine_file, max_state=MAX_STATE, trap_state=TRAP_STATE):
         """Initialize a machine given a machine text file.
         Sets most of the items to their base type and their empty
         initializations.
         Much like the implementation for Finite Automata,
         reads an input file to make the transition table.
+        max_state is the largest state the machine file may use, or None
+        for no limit, and trap_state is the state the machine falls into
+        when it has no transition to take.
         """
         self.TIMEOUT = 10000
+        self.max_state = max_state
+        self.trap_state = trap_state
         self.lookup = {}
         self.stack = []
         self.input = ''
@@ -22,10 +44,44 @@ class DPDA():
         self.language = []
         self.machine_type = ""
         self.states = set() 
+        # One message per problem found while reading the machine file
+        self.diagnostics = []
+        # Number of strings given up on because the machine reached a
+        # state it can't get to an accept state from
+        self.rejected_early = 0
+        # Counters filled in by run_machine when profiling, None
+        # otherwise so the runs don't count anything
+        self.stats = None
+        start = time.perf_counter()
         self.read_machine(machine_file)
+        self.parse_seconds = time.perf_counter() - start
         self.validate_determinism()
+        self.dead_states = self.find_dead_states()
         if self.machine_type == "":
             self.machine_type = "DPDA"
+        self.compile_seconds = time.perf_counter() - start - self.parse_seconds
+
+    def start_profile(self):
+        """Makes run_machine count the transitions it takes, the times
+        it enters the trap state, the strings it gives up on for a
+        character outside of the alphabet, and how often each state is
+        visited
+        """
+        self.stats = {"transitions": 0, "trap_entries": 0, "alphabet_rejections": 0, "visits": {}, "run_seconds": 0.0}
+
+    def count_step(self):
+        """Counts a transition taken from the current state
+        """
+        state = str(self.current_state)
+        self.stats["transitions"] += 1
+        self.stats["visits"][state] = self.stats["visits"].get(state, 0) + 1
+
+    def enter_trap(self):
+        """Moves the machine to the trap state
+        """
+        if self.stats is not None and self.current_state != self.trap_state:
+            self.stats["trap_entries"] += 1
+        self.current_state = self.trap_state
 
     def reset_machine(self):
         """Set the current state of the machine to 0
@@ -51,107 +107,136 @@ class DPDA():
                     return
         
 
+    def find_dead_states(self):
+        """Returns the set of states, as strings, that can't reach an
+        accept state whatever is read or on the stack. Only the states
+        are looked at and not the stack, so a state that is kept out
+        might still never accept, but a state in the set never will.
+        Any state can fall into the trap state, so if the trap state
+        can reach an accept state then no state is dead.
+        """
+        inverse = {}
+        for from_state in self.lookup:
+            for transition_char in self.lookup[from_state]:
+                for to_tuple in self.lookup[from_state][transition_char].values():
+                    inverse.setdefault(str(to_tuple[0]), set()).add(from_state)
+        live = set(self.accept)
+        pending = list(live)
+        while pending:
+            for from_state in inverse.get(pending.pop(), ()):
+                if from_state not in live:
+                    live.add(from_state)
+                    pending.append(from_state)
+        trap_state = str(self.trap_state)
+        if trap_state in live:
+            return set()
+        # The machine only ever gets to the start state, the trap state
+        # and the states transitions lead to
+        return (self.states | set(["0", trap_state])) - live
+
     def read_machine(self, machine_file):
         """Reads a machine and collects metrics based off a
         machine file.
+        The file is read in one go and each line is split on its
+        commas, only the lines that don't split cleanly into the five
+        fields of a transition go through the regular expression.
+        Reading doesn't stop at the first problem: every line is
+        checked and a message for each problem is added to
+        diagnostics, while the tables are left as they were when the
+        machine first turned out to be INVALID.
         """
         with open(machine_file, "r+") as definition:
+            lines = definition.read().split("\n")
+        try:
+            # Try reading the list of accept states from the
+            # first line of the file
+            self.accept = re.search("{(.+?)}", lines[0]).group(1).split(",")
+        except AttributeError:
+            # If we can't, we don't care. DFA can have no accept 
+            # states and still be valid.
+            pass
+        diagnostics = self.diagnostics
+        invalid = False
+        limit = self.max_state
+        if limit is None:
+            state_range = "a state"
+        else:
+            state_range = "a state from 0 to {}".format(limit)
+        for i in self.accept:
+            # Check that each accept state is a valid state
+            # 0-max_state
             try:
-                # Try reading the list of accept states from the
-                # first line of the file
-                self.accept = re.search("{(.+?)}", definition.readline()).group(1).split(",")
-            except AttributeError:
-                # If we can't, we don't care. DFA can have no accept 
-                # states and still be valid.
-                pass
-            for i in self.accept:
-                # Check that each accept state is a valid state
-                # 0-255
-                if not int(i) < 256:
-                    self.machine_type = "INVALID"
-                    return
-            for line in definition:
-                # If a line is empty, skip it because typos can exist
-                if re.match(r"\s",line):
+                valid = limit is None or int(i) <= limit
+            except ValueError:
+                valid = False
+            if not valid:
+                diagnostics.append("line 1: accept state {!r} is not {}".format(i, state_range))
+                invalid = True
+        # Most states are small and written without leading zeros, so
+        # they can be checked without converting them
+        state_names = set(str(x) for x in range(min(256, limit + 1) if limit is not None else 256))
+        states = self.states
+        alphabet = self.alphabet
+        stack_alpha = self.stack_alpha
+        lookup = self.lookup
+        for number, line in enumerate(lines[1:], 2):
+            # If a line is empty, skip it because typos can exist
+            if not line or line[0].isspace():
+                continue
+            fields = line.split(",")
+            if len(fields) != 5 or not (fields[0].isdecimal() and fields[3].isdecimal()):
+                # Commas in the characters or anything else out of the
+                # ordinary is left to the regular expression
+                line_search = line_regex.search(line)
+                if line_search is None:
+                    # If there isn't a transition on the line, the
+                    # PDA is invalid
+                    diagnostics.append("line {}: no transition found".format(number))
+                    invalid = True
                     continue
-                # Perform the regex match on each line using the 
-                # compiled regex on line 4
-                line_search = re.search(line_regex,line)
-                # Try to get a character from the capture groups 
-                # in the regular expression match
-                try:
-                    transition_char = line_search.group(2)
-                except AttributeError:
-                    # If there isn't anything in the character
-                    # capture group, then we don't have a transition
-                    # character, and the PDA is invalid
-                    self.machine_type = "INVALID"
-                    return
-                try:
-                    pop_char = line_search.group(3)
-                except AttributeError:
-                    # If we aren't given any character to pop, assume that
-                    # we are supposed to pop nothing. Perfectly 
-                    # normal behaviour
-                    pop_char = '`'
-                # Verify that both the beginning state and the
-                # state to transition to are valid states
-                # in the same way as the accept states
-                # and add that state to the list
-                # of states if it is valid
-                from_state = line_search.group(1)
-                if not int(from_state) < 256:
-                     self.machine_type = "INVALID"
-                     return
-                self.states.add(from_state)
-                to_state = line_search.group(4)
-                if not int(to_state) < 256:
-                     self.machine_type = "INVALID"
-                     return
-                self.states.add(to_state)
-                # Get the character to push onto the stack
-                try:
-                    push_char = line_search.group(5).strip()
-                except AttributeError:
-                    # Like the pop char, if we don't get anything
-                    # to push onto the stack, just assume it's an epsilon
-                    push_char = '`'
-                to_tuple = (to_state, push_char)
-                # If all works, add the transition character to 
-                # the list of characters in the alphabet
-                self.alphabet.add(transition_char)
-                self.stack_alpha.add(push_char)
-                self.stack_alpha.add(pop_char)
-                # If the transition character isn't one of 
-                # the printable characters then the machine is invalid
-                if transition_char not in chars:
-                    if transition_char == '`':
-                        pass
-                    else:
-                        self.machine_type = "INVALID"
-                        return
-
-                # Set up transition table
-                try:
-                    self.lookup[from_state]
-                except:
-                    self.lookup[from_state] = {}
-                
-                # Add character transitions to those states
-                try:
-                    self.lookup[from_state][transition_char]
-                except:
-                    self.lookup[from_state][transition_char] = {}
-                
-                # Add stack pop symbols to the transition
-                try:
-                    # If we have multiple (different) transitions for the same input character on the same
-                    # character we've popped from the stack, we're non deterministic
-                    self.lookup[from_state][transition_char][pop_char]
-                    if(to_tuple != self.lookup[from_state][transition_char][pop_char]):
-                        self.machine_type = 'NPDA'
-                except:
-                    self.lookup[from_state][transition_char][pop_char] = to_tuple
+                fields = line_search.groups()
+            from_state, transition_char, pop_char, to_state, push_char = fields
+            # Nothing to push is read as pushing an epsilon
+            push_char = push_char.strip()
+            from_valid = from_state in state_names or limit is None or int(from_state) <= limit
+            to_valid = to_state in state_names or limit is None or int(to_state) <= limit
+            char_valid = transition_char in chars
+            if not invalid:
+                # Add the states and the characters in the same order
+                # they are checked in, so a machine that turns out to
+                # be INVALID keeps what was added up to that point
+                if from_valid:
+                    states.add(from_state)
+                    if to_valid:
+                        states.add(to_state)
+                        alphabet.add(transition_char)
+                        stack_alpha.add(push_char)
+                        stack_alpha.add(pop_char)
+            if not from_valid:
+                diagnostics.append("line {}: state {} is not {}".format(number, from_state, state_range))
+            if not to_valid:
+                diagnostics.append("line {}: state {} is not {}".format(number, to_state, state_range))
+            if not char_valid:
+                diagnostics.append("line {}: character {!r} is not a printable character".format(number, transition_char))
+            if invalid or not (from_valid and to_valid and char_valid):
+                invalid = True
+                continue
+            to_tuple = (to_state, push_char)
+            # Set up the transition table, one level for the state,
+            # one for the character read and one for the character
+            # popped off the stack
+            pop_table = lookup.setdefault(from_state, {}).setdefault(transition_char, {})
+            if pop_char in pop_table:
+                # If we have multiple (different) transitions for the same input character on the same
+                # character we've popped from the stack, we're non deterministic
+                if to_tuple != pop_table[pop_char]:
+                    diagnostics.append("line {}: second transition on {!r} popping {!r} from state {}".format(
+                        number, transition_char, pop_char, from_state))
+                    self.machine_type = "NPDA"
+            else:
+                pop_table[pop_char] = to_tuple
+        if invalid:
+            self.machine_type = "INVALID"
             
 
     def run_machine(self, input_string):
@@ -163,20 +248,33 @@ class DPDA():
                 return
         # Initialize transitions so we can properly exit when there are too many transitions taken
         transitions = 0
-        # Convert the reversed string to a list to make it mutable
-        # Reversing it allows us to better use list operations to deal with the string
+        # Read the string by moving position along it rather than
+        # copying it, moving back puts a character back
         self.input = input_string
-        input_string = list(reversed(input_string))
+        position = 0
+        length = len(input_string)
+        stats = self.stats
+        dead_states = self.dead_states
         # run the machine with input string by performing table lookups based on
         # character and the current state
         # ALWAYS start by pushing a ` onto the stack so we know we can pop something off
         # While we have a character in the input string, we keep running
-        while input_string and transitions < self.TIMEOUT:
+        while position < length and transitions < self.TIMEOUT:
+            # Once in a dead state the string can't be accepted, so stop
+            # reading it
+            if dead_states and str(self.current_state) in dead_states:
+                self.rejected_early += 1
+                return
             transitions += 1
-            input_char = input_string.pop()
+            if stats is not None:
+                self.count_step()
+            input_char = input_string[position]
+            position += 1
             # If the character isn't valid in the alphabet, then
             # skip this string, as it's not valid in the language
             if input_char not in self.alphabet:
+                if stats is not None:
+                    stats["alphabet_rejections"] += 1
                 return
             try:
                 stack_char = self.stack.pop()
@@ -187,7 +285,7 @@ class DPDA():
                     if stack_char in self.lookup[str(self.current_state)]['`']:
                         # If there exists an epsilon transition, don't read a character (put it back in the list)
                         # and do the logic with the epsilon transition
-                        input_string.append(input_char)
+                        position -= 1
                         input_char = '`'
             except KeyError:
                 pass
@@ -211,15 +309,20 @@ class DPDA():
                         if to_tuple[1] is not '`':
                             self.stack.append(to_tuple[1])
                     except:
-                        self.current_state = 255
+                        self.enter_trap()
                         self.stack.append('`')
             except:
                 # If there isn't a lookup, we can just go to the trap state and write a ` to the stack
-                self.current_state = 255
+                self.enter_trap()
                 self.stack.append('`')
+        if str(self.current_state) in self.dead_states:
+            self.rejected_early += 1
+            return
         try:
-            while '`' in self.lookup[self.current_state].keys() and transitions < self.TIMEOUT and self.current_state != 255:
+            while '`' in self.lookup[self.current_state].keys() and transitions < self.TIMEOUT and self.current_state != self.trap_state:
                 transitions += 1
+                if stats is not None:
+                    self.count_step()
                 if self.stack:
                     stack_char = self.stack.pop()
                 else:
@@ -230,36 +333,187 @@ class DPDA():
                     if to_tuple[1] is not '`':
                         self.stack.append(to_tuple[1])
                 except:
-                    self.current_state = 255
+                    self.enter_trap()
 
         except:
             pass
         if str(self.current_state) in self.accept and transitions != self.TIMEOUT:
             self.language.append(self.input)
 
-for machine_file in os.listdir(os.path.dirname(__file__)):
-    input_count = 0
-    if ".pda" not in machine_file:
-        continue
+class LanguageWriter():
+    def __init__(self, path):
+        """Initialize a writer that stands in for the language list of a
+        machine. Every string appended goes straight to a buffered file
+        at path, and only the number of strings is kept, so memory
+        doesn't grow with the number of accepted strings.
+        """
+        self.language_file = open(path, "w+", buffering=1 << 20)
+        self.count = 0
+
+    def append(self, string):
+        """Writes a string to the language file
+        """
+        self.language_file.write("{}\n".format(string))
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Flushes and closes the language file
+        """
+        self.language_file.close()
+
+
+def input_lines(input_path, mapped=False):
+    """Yields every line of the input file, stripped. With mapped set
+    the file is mapped into memory and each line is found with find and
+    sliced straight out of the map, instead of going through a text
+    file. A carriage return on its own ends a line in a text file, so
+    the rare line holding one is split up the same way.
+    """
+    if not mapped:
+        with open(input_path, "r") as input_file:
+            for input_string in input_file:
+                yield input_string.strip()
+        return
+    if os.path.getsize(input_path) == 0:
+        return
+    with open(input_path, "rb") as input_file:
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = 0
+            end = len(data)
+            while position < end:
+                newline = data.find(b"\n", position)
+                if newline < 0:
+                    newline = end
+                line = data[position:newline].decode("utf-8", "replace")
+                if "\r" in line:
+                    for part in io.StringIO(line, newline=None):
+                        yield part.strip()
+                else:
+                    yield line.strip()
+                position = newline + 1
+
+
+def file_digest(path):
+    """Returns the SHA-256 hex digest of a file's contents, or None if
+    the file can't be read. Machine files and strings.txt are small, so
+    they are read in one go.
+    """
+    try:
+        with open(path, "rb") as hashed_file:
+            return hashlib.sha256(hashed_file.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def main(argv=None):
+    """Runs every machine in this directory against strings.txt and
+    writes the accepted strings and a log for each machine to results.
+    """
+    parser = argparse.ArgumentParser(description="Run the machines in this directory against strings.txt")
+    parser.add_argument("--force", action="store_true",
+                        help="rerun every machine, even if its results are up to date")
+    parser.add_argument("--profile", action="store_true",
+                        help="add timings, transition counts and state visits to each log")
+    parser.add_argument("--mmap", action="store_true",
+                        help="map strings.txt into memory and slice the lines straight out of it")
+    parser.add_argument("--stream", action="store_true",
+                        help="write accepted strings out as they are found instead of keeping them in memory")
+    parser.add_argument("--max-state", type=int, default=MAX_STATE,
+                        help="largest state a machine file may use, -1 for no limit")
+    parser.add_argument("--trap-state", type=int, default=TRAP_STATE,
+                        help="state a PDA falls into when it has no transition to take")
+    args = parser.parse_args(argv)
+    if args.max_state < 0:
+        args.max_state = None
+    if args.trap_state < 0:
+        parser.error("--trap-state can't be negative")
+
+    # Only rerun the machines whose machine file or input changed since
+    # the manifest was written, or whose results are gone
+    manifest_path = os.path.join(os.path.join(os.path.dirname(__file__),"results"), MANIFEST)
     try:
-        machine = DPDA(os.path.join(os.path.dirname(__file__),machine_file))
-        if machine.machine_type == "DPDA":
-            with open(os.path.join(os.path.dirname(__file__), "strings.txt"), "r") as input_file:
+        with open(manifest_path, "r") as manifest_file:
+            manifest = json.load(manifest_file)
+    except (IOError, ValueError):
+        manifest = {}
+    input_digest = file_digest(os.path.join(os.path.dirname(__file__), "strings.txt"))
+    machine_files = []
+    for machine_file in sorted(os.listdir(os.path.dirname(__file__))):
+        input_count = 0
+        if ".pda" not in machine_file:
+            continue
+        machine_files.append(machine_file)
+        key = {
+            "machine": file_digest(os.path.join(os.path.dirname(__file__),machine_file)),
+            "input": input_digest,
+            "engine_version": ENGINE_VERSION,
+            "profile": args.profile,
+            "max_state": args.max_state,
+            "trap_state": args.trap_state,
+        }
+        entry = manifest.get(machine_file)
+        if (not args.force and entry is not None and entry["key"] == key
+                and all(os.path.exists(os.path.join(os.path.join(os.path.dirname(__file__),"results"), x))
+                        for x in entry["outputs"])):
+            continue
+        manifest.pop(machine_file, None)
+        try:
+            machine = DPDA(os.path.join(os.path.dirname(__file__),machine_file), args.max_state, args.trap_state)
+            if args.stream:
+                machine.language = LanguageWriter(os.path.join(os.path.join(os.path.dirname(__file__),"results"),"{}.txt".format(machine_file.replace(".pda",""))))
+            if machine.machine_type == "DPDA":
                 input_count = 0
-                for input_string in input_file:
-                    input_string = input_string.strip()
+                if args.profile:
+                    machine.start_profile()
+                start = time.perf_counter()
+                for input_string in input_lines(os.path.join(os.path.dirname(__file__), "strings.txt"), args.mmap):
                     machine.reset_machine()
                     machine.run_machine(input_string)
                     input_count += 1
-                
-        with open(os.path.join(os.path.join(os.path.dirname(__file__),"results"),"{}.txt".format(machine_file.replace(".pda",""))), "w+") as lang_file:
-            for string in machine.language:
-                lang_file.write("{}\n".format(string))
-        with open(os.path.join(os.path.join(os.path.dirname(__file__),"results"),"{}.log".format(machine_file.replace(".pda",""))), "w+") as log_file:
-            log_file.write("Valid: {}\n".format(machine.machine_type))
-            log_file.write("States: {}\n".format(len(machine.states)))
-            log_file.write("Input Alphabet: {}\n".format(''.join(sorted([x for x in machine.alphabet if x is not '`']))))
-            log_file.write("Stack Alphabet: {}\n".format(''.join(sorted([x for x in machine.stack_alpha if x is not '`']))))
-            log_file.write("Accepted Strings: {} / {}\n".format(len(machine.language), input_count))
-    except IOError as e:
-        pass
+                if args.profile:
+                    machine.stats["run_seconds"] = time.perf_counter() - start
+                    
+            if isinstance(machine.language, LanguageWriter):
+                # The language was written as it was accepted
+                machine.language.close()
+            else:
+                with open(os.path.join(os.path.join(os.path.dirname(__file__),"results"),"{}.txt".format(machine_file.replace(".pda",""))), "w+") as lang_file:
+                    for string in machine.language:
+                        lang_file.write("{}\n".format(string))
+            with open(os.path.join(os.path.join(os.path.dirname(__file__),"results"),"{}.log".format(machine_file.replace(".pda",""))), "w+") as log_file:
+                log_file.write("Valid: {}\n".format(machine.machine_type))
+                log_file.write("States: {}\n".format(len(machine.states)))
+                log_file.write("Input Alphabet: {}\n".format(''.join(sorted([x for x in machine.alphabet if x is not '`']))))
+                log_file.write("Stack Alphabet: {}\n".format(''.join(sorted([x for x in machine.stack_alpha if x is not '`']))))
+                log_file.write("Accepted Strings: {} / {}\n".format(len(machine.language), input_count))
+                log_file.write("Rejected Early: {}\n".format(machine.rejected_early))
+                if machine.stats is not None:
+                    log_file.write("Parse Time: {:.6f}s\n".format(machine.parse_seconds))
+                    log_file.write("Compile Time: {:.6f}s\n".format(machine.compile_seconds))
+                    log_file.write("Run Time: {:.6f}s\n".format(machine.stats["run_seconds"]))
+                    log_file.write("Transitions: {}\n".format(machine.stats["transitions"]))
+                    log_file.write("Trap Entries: {}\n".format(machine.stats["trap_entries"]))
+                    log_file.write("Alphabet Rejections: {}\n".format(machine.stats["alphabet_rejections"]))
+                    log_file.write("State Visits: {}\n".format(" ".join("{}:{}".format(state, count) for state, count
+                                                                        in sorted(machine.stats["visits"].items(),
+                                                                                  key=lambda x: int(x[0])))))
+                for diagnostic in machine.diagnostics:
+                    log_file.write("Diagnostic: {}\n".format(diagnostic))
+            if key["machine"] is not None:
+                manifest[machine_file] = {"key": key, "outputs": ["{}.txt".format(machine_file.replace(".pda","")),
+                                                                  "{}.log".format(machine_file.replace(".pda",""))]}
+        except IOError as e:
+            pass
+
+    for machine_file in list(manifest):
+        if machine_file not in machine_files:
+            del manifest[machine_file]
+    if os.path.exists(os.path.join(os.path.dirname(__file__),"results")):
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import os
+import tempfile
+import unittest
+import PDA
+
+# Folder the bundled machines and strings.txt are in
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# What the original PDA.py read from each bundled machine and accepted
+# out of strings.txt: type, states, input alphabet, stack alphabet,
+# diagnostics and language
+BUNDLED = {
+    "m00.pda": ("DPDA", ["0", "1", "2", "3"], "#`ab", "$`ab", [], ["aaaa#aaaa"]),
+    "m01.pda": ("NPDA", ["0", "1", "2", "3", "4", "5", "6", "7"], "`abc", "$`a",
+                ["line 5: second transition on '`' popping '`' from state 2"], []),
+    "m02.pda": ("DPDA", ["0", "1", "2", "3"], "`ab", "$`ab", [], []),
+    "m03.pda": ("DPDA", ["0", "1", "2", "3"], "#`ab", "#$`", [], []),
+    "m04.pda": ("DPDA", ["0", "1", "2", "3", "4"], "#'`ab", "$`x", [], ["a#a#aa'"]),
+    "m05.pda": ("DPDA", ["0", "1", "2", "3", "4"], "`ab", "$`a", [], ["", ""]),
+}
+
+# Machine files with awkward lines, with what the original PDA.py read
+# from them and accepted out of STRINGS, in the same order as BUNDLED
+PALINDROME = "{3}\n0,`,`,1,$\n1,a,`,1,a\n1,#,`,2,`\n2,a,a,2,`\n2,`,$,3,`\n"
+EDGE_CASES = [
+    # A comma as the character read, and as the character pushed
+    ("{1}\n0,,,`,1,`\n", ("DPDA", ["0", "1"], ",", "`", [], [","])),
+    ("{2}\n0,`,`,1,$\n1,,,`,1,,\n1,#,`,2,`\n", ("DPDA", ["0", "1", "2"], "#,`", "$,`", [], ["#"])),
+    # Windows and old Mac line endings
+    (PALINDROME.replace("\n", "\r\n"), ("DPDA", ["0", "1", "2", "3"], "#`a", "$`a", [], ["a#a", "aa#aa", "#"])),
+    (PALINDROME.replace("\n", "\r"), ("DPDA", ["0", "1", "2", "3"], "#`a", "$`a", [], ["a#a", "aa#aa", "#"])),
+    # States and characters out of range
+    ("{1}\n0,a,`,300,`\n0,b,`,1,`\n", ("INVALID", ["0"], "", "", ["line 2: state 300 is not a state from 0 to 255"], None)),
+    ("{256}\n0,a,`,1,`\n", ("INVALID", [], "", "", ["line 1: accept state '256' is not a state from 0 to 255"], None)),
+    ("{1}\n0,é,`,1,`\n", ("INVALID", ["0", "1"], "é", "`",
+                              ["line 2: character 'é' is not a printable character"], None)),
+    # A line that isn't a transition, and lines that are skipped
+    ("{1}\n0,a,`,1,`\nhello\n1,b,`,1,`\n", ("INVALID", ["0", "1"], "a", "`", ["line 3: no transition found"], None)),
+    ("{1}\n\n0,a,`,1,`\n 1,b,`,1,`\n", ("DPDA", ["0", "1"], "a", "`", [], ["a"])),
+    # Two transitions on the same character and stack character
+    ("{1}\n0,a,`,1,`\n0,a,`,2,`\n", ("NPDA", ["0", "1", "2"], "a", "`",
+                                     ["line 3: second transition on 'a' popping '`' from state 0"], None)),
+    # The trap state is a state like any other, and can accept
+    ("{255}\n0,a,`,1,`\n", ("DPDA", ["0", "1"], "a", "`", [], ["aa"])),
+]
+STRINGS = ["", "a", "aa", ",", "a#a", "aa#aa", "aa#a", "b", "#", "a,#"]
+
+
+def write_machine(text):
+    """Writes the text of a machine file to a temporary file, as it is,
+    and returns its path
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".pda", delete=False, newline="") as machine_file:
+        machine_file.write(text)
+    return machine_file.name
+
+
+def run_strings(machine, strings):
+    """Runs strings through a machine and returns its language
+    """
+    for input_string in strings:
+        machine.reset_machine()
+        machine.run_machine(input_string)
+    return machine.language
+
+
+def parse_results(machine):
+    """Returns what was read from a machine file, in the order BUNDLED
+    and EDGE_CASES list it
+    """
+    return (machine.machine_type, sorted(machine.states, key=int), "".join(sorted(machine.alphabet)),
+            "".join(sorted(machine.stack_alpha)), machine.diagnostics)
+
+
+class BundledTest(unittest.TestCase):
+    def test_bundled_machines(self):
+        """The bundled machines read and accept what they always did
+        """
+        strings = list(PDA.input_lines(os.path.join(HERE, "strings.txt")))
+        for machine_file, expected in sorted(BUNDLED.items()):
+            machine = PDA.DPDA(os.path.join(HERE, machine_file))
+            self.assertEqual(parse_results(machine), expected[:5])
+            if machine.machine_type == "DPDA":
+                self.assertEqual(run_strings(machine, strings), expected[5])
+
+
+class EdgeCaseTest(unittest.TestCase):
+    def test_edge_cases(self):
+        """Awkward machine files read and accept what they always did
+        """
+        for text, expected in EDGE_CASES:
+            path = write_machine(text)
+            try:
+                machine = PDA.DPDA(path)
+            finally:
+                os.unlink(path)
+            self.assertEqual(parse_results(machine), expected[:5], repr(text))
+            if expected[5] is not None:
+                self.assertEqual(run_strings(machine, STRINGS), expected[5], repr(text))
+
+
+class LimitTest(unittest.TestCase):
+    def test_max_state(self):
+        """States past the limit are INVALID, and any state goes without
+        a limit
+        """
+        path = write_machine("{300}\n0,a,`,300,`\n")
+        try:
+            self.assertEqual(PDA.DPDA(path).machine_type, "INVALID")
+            self.assertEqual(PDA.DPDA(path, max_state=300).machine_type, "DPDA")
+            machine = PDA.DPDA(path, max_state=None)
+            self.assertEqual(machine.machine_type, "DPDA")
+            self.assertEqual(run_strings(machine, STRINGS), ["a"])
+        finally:
+            os.unlink(path)
+
+    def test_trap_state(self):
+        """Strings with no transition to take fall into the trap state,
+        which only accepts if it is an accept state
+        """
+        path = write_machine("{7}\n0,a,`,1,`\n")
+        try:
+            self.assertEqual(run_strings(PDA.DPDA(path), STRINGS), [])
+            self.assertEqual(run_strings(PDA.DPDA(path, trap_state=7), STRINGS), ["aa"])
+        finally:
+            os.unlink(path)
+
+
+class DeadStateTest(unittest.TestCase):
+    def test_dead_states(self):
+        """States that can't reach an accept state are dead, strings that
+        reach one are given up on, and the language doesn't change
+        """
+        path = write_machine("{2}\n0,a,`,1,`\n0,b,`,2,`\n1,a,`,1,`\n2,a,`,2,`\n")
+        try:
+            machine = PDA.DPDA(path)
+        finally:
+            os.unlink(path)
+        self.assertEqual(machine.dead_states, set(["1", "255"]))
+        self.assertEqual(run_strings(machine, ["b", "ba", "aa", "aaa", "ab"]), ["b", "ba"])
+        self.assertEqual(machine.rejected_early, 3)
+
+    def test_no_dead_states_when_trap_accepts(self):
+        """Every state can fall into the trap state, so none is dead if
+        the trap state accepts
+        """
+        path = write_machine("{255}\n0,a,`,1,`\n")
+        try:
+            self.assertEqual(PDA.DPDA(path).dead_states, set())
+        finally:
+            os.unlink(path)
+
+
+class ProfileTest(unittest.TestCase):
+    def test_profile(self):
+        """Profiling counts the steps taken without changing the language
+        """
+        strings = list(PDA.input_lines(os.path.join(HERE, "strings.txt")))
+        for machine_file in sorted(BUNDLED):
+            machine = PDA.DPDA(os.path.join(HERE, machine_file))
+            machine.start_profile()
+            self.assertEqual(run_strings(machine, strings), BUNDLED[machine_file][5])
+        machine = PDA.DPDA(os.path.join(HERE, "m00.pda"))
+        machine.start_profile()
+        run_strings(machine, ["a#a", "c"])
+        # a#a pushes $, reads a, # and a and pops $, and c pushes $ before
+        # it is given up on
+        self.assertEqual(machine.stats["transitions"], 6)
+        self.assertEqual(machine.stats["visits"], {"0": 2, "1": 2, "2": 2})
+        self.assertEqual(machine.stats["alphabet_rejections"], 1)
+
+
+class InputTest(unittest.TestCase):
+    def test_mapped_lines(self):
+        """Lines read out of a map are the lines of a text file
+        """
+        with tempfile.NamedTemporaryFile("wb", suffix=".txt", delete=False) as input_file:
+            input_file.write(b"a#a\nba\xc2\xa0\nba\r\n\xe3\x80\x80ba\nba\rab\n\r\rab\n \t0 1\nab\r")
+        try:
+            self.assertEqual(list(PDA.input_lines(input_file.name, True)), list(PDA.input_lines(input_file.name)))
+        finally:
+            os.unlink(input_file.name)
+
+    def test_language_writer(self):
+        """A language writer writes every string on its own line and
+        counts them
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as language_file:
+            pass
+        try:
+            language = PDA.LanguageWriter(language_file.name)
+            language.append("a#a")
+            language.append("")
+            self.assertEqual(len(language), 2)
+            language.close()
+            with open(language_file.name) as written:
+                self.assertEqual(written.read(), "a#a\n\n")
+        finally:
+            os.unlink(language_file.name)
+
+
+if __name__ == "__main__":
+    unittest.main()